@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# bench.py -- text categorization benchmarks
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import tc
+
+
+CONSONANTS = 'bcdfghjklmnprstvwz'
+P1         = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'p1.py')
+SUFFIXES   = ('', '', '', 's', 'ed', 'ing', 'er', 'ly')
+VOWELS     = 'aeiou'
+
+
+def gen_corpus(args, dir):
+    rng = np.random.default_rng(args.seed)
+
+    # pronounceable words with inflectional endings, so that case
+    # folding, stop words and stemming all have something to do
+    words = [ ]
+    seen  = set()
+    while len(words) < args.vocab:
+        word  = ''.join(
+            rng.choice(list(CONSONANTS)) + rng.choice(list(VOWELS))
+            for _ in range(rng.integers(1, 4))
+        )
+        word += SUFFIXES[rng.integers(len(SUFFIXES))]
+
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+
+    words = np.array(words)
+
+    # every category mixes the global zipf distribution with a copy of
+    # it over its own random permutation of the vocabulary
+    zipf  = 1.0 / np.arange(1, args.vocab + 1) ** args.zipf
+    zipf /= zipf.sum()
+    dists = [ ]
+    for _ in range(args.categories):
+        dists.append((1 - args.topicality) * zipf + args.topicality * zipf[rng.permutation(args.vocab)])
+
+    os.makedirs(os.path.join(dir, 'docs'), exist_ok=True)
+
+    labeled = [ ]
+    for i in range(args.docs):
+        cat    = int(rng.integers(args.categories))
+        length = max(1, int(rng.poisson(args.doc_len)))
+        tokens = words[rng.choice(args.vocab, size=length, p=dists[cat])].tolist()
+
+        # sentences of a few words, capitalized and punctuated
+        sentences = [ ]
+        for j in range(0, length, 12):
+            sentence = ' '.join(tokens[j:j + 12])
+            sentences.append(sentence[0].upper() + sentence[1:] + '.')
+
+        path = os.path.join(dir, 'docs', f'{i}.txt')
+        with open(path, 'w') as f:
+            f.write(' '.join(sentences) + '\n')
+
+        labeled.append((f'cat{cat}', path))
+
+    processor = tc.Processor()
+    split     = int(len(labeled) * (1 - args.test_ratio))
+
+    files = {
+        'test_labels':  os.path.join(dir, 'test.labels'),
+        'test_list':    os.path.join(dir, 'test.list'),
+        'train_labels': os.path.join(dir, 'train.labels'),
+    }
+
+    with open(files['train_labels'], 'w') as f:
+        processor.write_cat_file_tuples(labeled[:split], f)
+
+    with open(files['test_labels'], 'w') as f:
+        processor.write_cat_file_tuples(labeled[split:], f)
+
+    with open(files['test_list'], 'w') as f:
+        processor.write_file_list(labeled[split:], f)
+
+    return files, split, len(labeled) - split
+
+
+def peak_rss():
+    # kibibytes on linux, the children cover -j/--jobs workers
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def run(args, dir):
+    report = {
+        'params': {
+            'categories': args.categories,
+            'doc_len':    args.doc_len,
+            'docs':       args.docs,
+            'jobs':       args.jobs,
+            'seed':       args.seed,
+            'startup':    args.startup_runs,
+            'tokenizer':  args.tokenizer,
+            'topicality': args.topicality,
+            'vocab':      args.vocab,
+            'zipf':       args.zipf,
+        },
+        'stages': { },
+    }
+
+    stages = report['stages']
+
+    @contextlib.contextmanager
+    def stage(name, docs=None):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+
+        stages[name] = {
+            'peak_rss_kib': peak_rss(),
+            'seconds':      elapsed,
+        }
+
+        if docs is not None:
+            stages[name]['docs_per_sec'] = docs / elapsed if elapsed else 0.0
+
+    with stage('generate'):
+        files, train_cnt, test_cnt = gen_corpus(args, dir)
+
+    db_path  = os.path.join(dir, 'bench.db')
+    out_path = os.path.join(dir, 'bench.out')
+
+    trainer = tc.Trainer(jobs=args.jobs, tokenizer=args.tokenizer)
+    with stage('train', train_cnt), open(files['train_labels']) as f:
+        trainer.train(f)
+
+    with stage('dump'), open(db_path, 'wb') as f:
+        trainer.dump(f)
+
+    del trainer
+
+    tester = tc.Tester(jobs=args.jobs)
+    with stage('load'), open(db_path, 'rb') as f:
+        tester.load(f)
+
+    with stage('test', test_cnt), open(files['test_list']) as f:
+        tester.stream(f, out_path)
+
+    # cold start latency of a fresh test process on a single document,
+    # which is dominated by imports and loading the database
+    tiny_list = os.path.join(dir, 'tiny.list')
+    with open(files['test_list']) as f, open(tiny_list, 'w') as tiny:
+        tiny.write(f.readline())
+
+    cmd = [
+        sys.executable, P1, 'test',
+        '-d', db_path,
+        '-i', tiny_list,
+        '-o', os.path.join(dir, 'tiny.out'),
+    ]
+
+    runs = [ ]
+    for _ in range(args.startup_runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True)
+        runs.append(time.perf_counter() - start)
+
+    if runs:
+        stages['startup'] = {
+            'peak_rss_kib': peak_rss(),
+            'seconds':      statistics.median(runs),
+            'seconds_min':  min(runs),
+        }
+
+    # documents are single labeled, so micro f1 is the accuracy
+    processor = tc.Processor()
+    with open(files['test_labels']) as f:
+        truth = dict((path, cat) for (cat, path) in processor.iter_cat_file_tuples(f))
+
+    with open(out_path) as f:
+        correct = sum(truth[path] == cat for (cat, path) in processor.iter_cat_file_tuples(f))
+
+    report['db_bytes']     = os.path.getsize(db_path)
+    report['micro_f1']     = correct / test_cnt if test_cnt else 0.0
+    report['peak_rss_kib'] = peak_rss()
+
+    return report
+
+
+def compare(report, baseline, tolerance):
+    regressions = [ ]
+
+    if report['params'] != baseline.get('params'):
+        print('warning: benchmark parameters differ from the baseline', file=sys.stderr)
+
+    def check(name, new, old, higher_is_better=False):
+        if not old:
+            return
+
+        change = (new - old) / old
+        if higher_is_better:
+            change = -change
+
+        if change > tolerance:
+            regressions.append({
+                'baseline': old,
+                'change':   change,
+                'current':  new,
+                'metric':   name,
+            })
+
+    # stages this short are dominated by noise
+    for name, stage in report['stages'].items():
+        old = baseline.get('stages', { }).get(name)
+        if old is not None and max(stage['seconds'], old['seconds']) >= 0.05:
+            check(f'stages.{name}.seconds', stage['seconds'], old['seconds'])
+
+    check('db_bytes', report['db_bytes'], baseline.get('db_bytes'))
+    check('micro_f1', report['micro_f1'], baseline.get('micro_f1'), higher_is_better=True)
+    check('peak_rss_kib', report['peak_rss_kib'], baseline.get('peak_rss_kib'))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text categorization benchmarks')
+
+    parser.add_argument(
+        '-b',
+        '--baseline',
+        help='compare against a saved report',
+        metavar='baseline',
+        type=argparse.FileType('r'),
+    )
+    parser.add_argument(
+        '-c',
+        '--categories',
+        default=8,
+        help='number of categories',
+        metavar='categories',
+        type=int,
+    )
+    parser.add_argument(
+        '-d',
+        '--docs',
+        default=2000,
+        help='number of documents',
+        metavar='docs',
+        type=int,
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of normalization processes',
+        metavar='jobs',
+        type=int,
+    )
+    parser.add_argument(
+        '-l',
+        '--doc-len',
+        default=200,
+        help='mean document length in words',
+        metavar='words',
+        type=int,
+    )
+    parser.add_argument(
+        '-o',
+        help='output report, stdout if omitted',
+        metavar='output',
+        type=argparse.FileType('w'),
+    )
+    parser.add_argument(
+        '-s',
+        '--zipf',
+        default=1.1,
+        help='zipf exponent of the word distribution',
+        metavar='skew',
+        type=float,
+    )
+    parser.add_argument(
+        '-t',
+        '--tolerance',
+        default=0.10,
+        help='relative change tolerated before a regression is reported',
+        metavar='ratio',
+        type=float,
+    )
+    parser.add_argument(
+        '-V',
+        '--vocab',
+        default=20000,
+        help='vocabulary size',
+        metavar='words',
+        type=int,
+    )
+    parser.add_argument(
+        '-w',
+        '--workdir',
+        help='directory for the generated corpus, temporary if omitted',
+        metavar='dir',
+    )
+    parser.add_argument(
+        '--seed',
+        default=467,
+        help='random seed',
+        metavar='seed',
+        type=int,
+    )
+    parser.add_argument(
+        '--startup-runs',
+        default=5,
+        help='number of cold start test runs on a single document, 0 skips',
+        metavar='runs',
+        type=int,
+    )
+    parser.add_argument(
+        '--test-ratio',
+        default=1 / 3,
+        help='fraction of documents held out for testing',
+        metavar='ratio',
+        type=float,
+    )
+    parser.add_argument(
+        '--tokenizer',
+        choices=tc.TOKENIZERS,
+        default='nltk',
+        help='tokenizer backend',
+    )
+    parser.add_argument(
+        '--topicality',
+        default=0.1,
+        help='weight of the category specific word distribution',
+        metavar='ratio',
+        type=float,
+    )
+
+    args = parser.parse_args()
+
+    if args.workdir is not None:
+        report = run(args, args.workdir)
+    else:
+        with tempfile.TemporaryDirectory() as dir:
+            report = run(args, dir)
+
+    regressions = [ ]
+    if args.baseline is not None:
+        regressions = compare(report, json.load(args.baseline), args.tolerance)
+        report['regressions'] = regressions
+
+    out = args.o or sys.stdout
+    out.write(json.dumps(report, indent=4) + '\n')
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# client.py -- text categorization client
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import socket
+import sys
+
+
+class Client:
+    def __init__(self, host=None, port=None, path=None):
+        if path is not None:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(path)
+        else:
+            self._sock = socket.create_connection((host, port))
+
+        self._file = self._sock.makefile('rwb')
+
+    def classify(self, reqs):
+        # pipeline every request before reading any response
+        for req in reqs:
+            self._file.write(json.dumps(req).encode() + b'\n')
+
+        self._file.flush()
+
+        return [json.loads(self._file.readline()) for _ in reqs]
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def add_address_arguments(parser):
+    parser.add_argument(
+        '-H',
+        '--host',
+        default='127.0.0.1',
+        help='server host',
+        metavar='host',
+    )
+    parser.add_argument(
+        '-p',
+        '--port',
+        default=4670,
+        help='server port',
+        metavar='port',
+        type=int,
+    )
+    parser.add_argument(
+        '-s',
+        '--socket',
+        help='server unix socket, overrides host and port',
+        metavar='socket',
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text categorization client')
+
+    add_address_arguments(parser)
+    parser.add_argument(
+        '-t',
+        '--text',
+        action='store_true',
+        help='send document contents instead of paths',
+    )
+    parser.add_argument(
+        'documents',
+        help='documents to classify, read from stdin if omitted',
+        metavar='document',
+        nargs='*',
+    )
+
+    args = parser.parse_args()
+
+    paths = args.documents or [line.strip() for line in sys.stdin]
+
+    reqs = [ ]
+    for path in paths:
+        if args.text:
+            with open(path, 'r') as f:
+                reqs.append({'text': f.read()})
+        else:
+            reqs.append({'path': path})
+
+    client = Client(args.host, args.port, args.socket)
+
+    for path, resp in zip(paths, client.classify(reqs)):
+        if 'error' in resp:
+            print(f"error: '{path}': {resp['error']}", file=sys.stderr)
+        else:
+            print(f"{path} {resp['category']}")
+
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
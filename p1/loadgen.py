@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# loadgen.py -- text categorization server load generator
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import client
+
+
+async def connection(args, reqs, latencies):
+    if args.socket is not None:
+        reader, writer = await asyncio.open_unix_connection(args.socket, limit=1 << 24)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port, limit=1 << 24)
+
+    errors = 0
+
+    # closed loop: one outstanding request per connection
+    for req in reqs:
+        start = time.perf_counter()
+
+        writer.write(req)
+        await writer.drain()
+
+        resp = json.loads(await reader.readline())
+
+        latencies.append(time.perf_counter() - start)
+
+        if 'error' in resp:
+            errors += 1
+
+    writer.close()
+    await writer.wait_closed()
+
+    return errors
+
+
+async def run(args):
+    paths = [line.strip() for line in args.i]
+
+    reqs = [ ]
+    for path in itertools.islice(itertools.cycle(paths), args.requests):
+        if args.text:
+            with open(path, 'r') as f:
+                req = {'text': f.read()}
+        else:
+            req = {'path': path}
+
+        reqs.append(json.dumps(req).encode() + b'\n')
+
+    latencies = [ ]
+
+    start  = time.perf_counter()
+    errors = await asyncio.gather(*[
+        connection(args, reqs[i::args.concurrency], latencies)
+        for i in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        'concurrency':    args.concurrency,
+        'errors':         sum(errors),
+        'latency_ms': {
+            'max': latencies[-1] * 1000,
+            'p50': percentile(0.50),
+            'p90': percentile(0.90),
+            'p99': percentile(0.99),
+        },
+        'requests':       len(latencies),
+        'seconds':        elapsed,
+        'throughput_rps': len(latencies) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text categorization load generator')
+
+    client.add_address_arguments(parser)
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        default=16,
+        help='number of concurrent connections',
+        metavar='connections',
+        type=int,
+    )
+    parser.add_argument(
+        '-i',
+        help='input test documents',
+        metavar='input',
+        required=True,
+        type=argparse.FileType('r'),
+    )
+    parser.add_argument(
+        '-n',
+        '--requests',
+        default=1000,
+        help='total number of requests',
+        metavar='requests',
+        type=int,
+    )
+    parser.add_argument(
+        '-t',
+        '--text',
+        action='store_true',
+        help='send document contents instead of paths',
+    )
+
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -17,19 +17,239 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import json
+import os
 
+import predcache
 import tc
+import tokcache
+
+
+def make_prefetcher(args):
+    if args.prefetch <= 0:
+        return None
+
+    return tc.Prefetcher(args.prefetch, args.prefetch_depth)
+
+
+def open_token_cache(args):
+    if args.token_cache is None:
+        return None
+
+    return tokcache.TokenCache(args.token_cache, args.token_cache_size << 20)
 
 
 def main():
     parser = argparse.ArgumentParser(description='text categorization')
     subparser = parser.add_subparsers(
         dest='mode',
-        help='{test,testgen,train} -h/--help',
+        help='{eval,merge,serve,test,testgen,train,update} -h/--help',
         metavar='mode',
         required=True,
     )
 
+    eval_subparser = subparser.add_parser('eval')
+    eval_subparser.add_argument(
+        '-i',
+        help='labeled corpus documents',
+        metavar='input',
+        required=True,
+        type=argparse.FileType('r'),
+    )
+    eval_subparser.add_argument(
+        '-k',
+        '--folds',
+        default=5,
+        help='number of cross validation folds',
+        metavar='folds',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '-o',
+        help='output report as json',
+        metavar='output',
+        type=argparse.FileType('w'),
+    )
+    eval_subparser.add_argument(
+        '--case-sensitive',
+        action='store_true',
+        help='do not fold case while normalizing',
+    )
+    eval_subparser.add_argument(
+        '--no-stemming',
+        action='store_true',
+        help='do not stem while normalizing',
+    )
+    eval_subparser.add_argument(
+        '--no-stop-words',
+        action='store_true',
+        help='keep stop words while normalizing',
+    )
+    eval_subparser.add_argument(
+        '--hash-bits',
+        default=0,
+        help='hash terms into 2^bits signed buckets, 0 disables',
+        metavar='bits',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--max-df',
+        default=1.0,
+        help='prune terms found in more than this fraction of documents',
+        metavar='ratio',
+        type=float,
+    )
+    eval_subparser.add_argument(
+        '--min-df',
+        default=1,
+        help='prune terms found in fewer documents',
+        metavar='docs',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--top-n',
+        default=0,
+        help='keep only the heaviest terms of every category, 0 keeps all',
+        metavar='terms',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--seed',
+        help='random seed of the fold assignment',
+        metavar='seed',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of normalization and fold processes',
+        metavar='jobs',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--tokenizer',
+        choices=tc.TOKENIZERS,
+        default='nltk',
+        help='tokenizer backend',
+    )
+    eval_subparser.add_argument(
+        '--prefetch',
+        default=0,
+        help='number of threads reading documents ahead, 0 disables',
+        metavar='threads',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--prefetch-depth',
+        default=64,
+        help='maximum number of documents read ahead',
+        metavar='docs',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '--token-cache',
+        help='persistent cache of normalized documents',
+        metavar='cache',
+    )
+    eval_subparser.add_argument(
+        '--token-cache-size',
+        default=1024,
+        help='maximum size of the token cache in MiB',
+        metavar='size',
+        type=int,
+    )
+    eval_subparser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='enable verbose output',
+    )
+
+    merge_subparser = subparser.add_parser('merge')
+    merge_subparser.add_argument(
+        'partials',
+        help='input partial databases, in corpus order',
+        metavar='partial',
+        nargs='+',
+    )
+    merge_subparser.add_argument(
+        '-d',
+        help='output trained database',
+        metavar='db',
+        required=True,
+        type=argparse.FileType('wb'),
+    )
+    merge_subparser.add_argument(
+        '--partial',
+        action='store_true',
+        help='output another partial database instead of finalizing',
+    )
+    merge_subparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of merge processes',
+        metavar='jobs',
+        type=int,
+    )
+    merge_subparser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='enable verbose output',
+    )
+
+    serve_subparser = subparser.add_parser('serve')
+    serve_subparser.add_argument(
+        '-d',
+        help='input trained database',
+        metavar='db',
+        required=True,
+        type=argparse.FileType('rb'),
+    )
+    serve_subparser.add_argument(
+        '-H',
+        '--host',
+        default='127.0.0.1',
+        help='listen host',
+        metavar='host',
+    )
+    serve_subparser.add_argument(
+        '-p',
+        '--port',
+        default=4670,
+        help='listen port',
+        metavar='port',
+        type=int,
+    )
+    serve_subparser.add_argument(
+        '-s',
+        '--socket',
+        help='listen on a unix socket instead of host and port',
+        metavar='socket',
+    )
+    serve_subparser.add_argument(
+        '--max-batch',
+        default=64,
+        help='maximum number of documents scored together',
+        metavar='docs',
+        type=int,
+    )
+    serve_subparser.add_argument(
+        '--max-wait',
+        default=2.0,
+        help='milliseconds to wait for a batch to fill',
+        metavar='ms',
+        type=float,
+    )
+    serve_subparser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='enable verbose output',
+    )
+
     test_subparser = subparser.add_parser('test')
     test_subparser.add_argument(
         '-d',
@@ -47,11 +267,75 @@ def main():
     )
     test_subparser.add_argument(
         '-o',
-        help='output labeled documents',
+        help='output labeled documents, - for stdout',
         metavar='output',
         required=True,
+    )
+    test_subparser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='normalize and score documents with identical contents once',
+    )
+    test_subparser.add_argument(
+        '--max-score',
+        action='store_true',
+        help='score documents one by one with max-score pruning',
+    )
+    test_subparser.add_argument(
+        '--prediction-cache',
+        help='persistent cache of predictions, implies --dedup',
+        metavar='cache',
+    )
+    test_subparser.add_argument(
+        '--resume',
+        action='store_true',
+        help='skip documents already labeled in the output',
+    )
+    test_subparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of normalization processes',
+        metavar='jobs',
+        type=int,
+    )
+    test_subparser.add_argument(
+        '--prefetch',
+        default=0,
+        help='number of threads reading documents ahead, 0 disables',
+        metavar='threads',
+        type=int,
+    )
+    test_subparser.add_argument(
+        '--prefetch-depth',
+        default=64,
+        help='maximum number of documents read ahead',
+        metavar='docs',
+        type=int,
+    )
+    test_subparser.add_argument(
+        '--token-cache',
+        help='persistent cache of normalized documents',
+        metavar='cache',
+    )
+    test_subparser.add_argument(
+        '--token-cache-size',
+        default=1024,
+        help='maximum size of the token cache in MiB',
+        metavar='size',
+        type=int,
+    )
+    test_subparser.add_argument(
+        '--stats',
+        help='output per-stage timings as json',
+        metavar='stats',
         type=argparse.FileType('w'),
     )
+    test_subparser.add_argument(
+        '--trace',
+        action='store_true',
+        help='print every document as it is processed',
+    )
     test_subparser.add_argument(
         '-v',
         '--verbose',
@@ -90,6 +374,168 @@ def main():
         type=argparse.FileType('wb'),
     )
     train_subparser.add_argument(
+        '--hash-bits',
+        default=0,
+        help='hash terms into 2^bits signed buckets, 0 disables',
+        metavar='bits',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--max-df',
+        default=1.0,
+        help='prune terms found in more than this fraction of documents',
+        metavar='ratio',
+        type=float,
+    )
+    train_subparser.add_argument(
+        '--min-df',
+        default=1,
+        help='prune terms found in fewer documents',
+        metavar='docs',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--top-n',
+        default=0,
+        help='keep only the heaviest terms of every category, 0 keeps all',
+        metavar='terms',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--partial',
+        action='store_true',
+        help='output raw counts to be merged later',
+    )
+    train_subparser.add_argument(
+        '--save-stem-cache',
+        action='store_true',
+        help='store the warmed stem cache in the database',
+    )
+    train_subparser.add_argument(
+        '--stem-cache-size',
+        default=65536,
+        help='maximum number of cached stems',
+        metavar='size',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of normalization processes',
+        metavar='jobs',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--tokenizer',
+        choices=tc.TOKENIZERS,
+        default='nltk',
+        help='tokenizer backend',
+    )
+    train_subparser.add_argument(
+        '--prefetch',
+        default=0,
+        help='number of threads reading documents ahead, 0 disables',
+        metavar='threads',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--prefetch-depth',
+        default=64,
+        help='maximum number of documents read ahead',
+        metavar='docs',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--token-cache',
+        help='persistent cache of normalized documents',
+        metavar='cache',
+    )
+    train_subparser.add_argument(
+        '--token-cache-size',
+        default=1024,
+        help='maximum size of the token cache in MiB',
+        metavar='size',
+        type=int,
+    )
+    train_subparser.add_argument(
+        '--stats',
+        help='output per-stage timings as json',
+        metavar='stats',
+        type=argparse.FileType('w'),
+    )
+    train_subparser.add_argument(
+        '--trace',
+        action='store_true',
+        help='print every document as it is processed',
+    )
+    train_subparser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='enable verbose output',
+    )
+
+    update_subparser = subparser.add_parser('update')
+    update_subparser.add_argument(
+        '-i',
+        help='input training documents',
+        metavar='input',
+        required=True,
+        type=argparse.FileType('r'),
+    )
+    update_subparser.add_argument(
+        '-d',
+        help='trained database to update',
+        metavar='db',
+        required=True,
+    )
+    update_subparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of normalization processes',
+        metavar='jobs',
+        type=int,
+    )
+    update_subparser.add_argument(
+        '--prefetch',
+        default=0,
+        help='number of threads reading documents ahead, 0 disables',
+        metavar='threads',
+        type=int,
+    )
+    update_subparser.add_argument(
+        '--prefetch-depth',
+        default=64,
+        help='maximum number of documents read ahead',
+        metavar='docs',
+        type=int,
+    )
+    update_subparser.add_argument(
+        '--token-cache',
+        help='persistent cache of normalized documents',
+        metavar='cache',
+    )
+    update_subparser.add_argument(
+        '--token-cache-size',
+        default=1024,
+        help='maximum size of the token cache in MiB',
+        metavar='size',
+        type=int,
+    )
+    update_subparser.add_argument(
+        '--stats',
+        help='output per-stage timings as json',
+        metavar='stats',
+        type=argparse.FileType('w'),
+    )
+    update_subparser.add_argument(
+        '--trace',
+        action='store_true',
+        help='print every document as it is processed',
+    )
+    update_subparser.add_argument(
         '-v',
         '--verbose',
         action='store_true',
@@ -98,15 +544,142 @@ def main():
 
     args = parser.parse_args()
 
-    if args.mode == 'train':
-        trainer = tc.Trainer(verbose=args.verbose)
+    if args.mode == 'test' and args.resume and args.o == '-':
+        test_subparser.error('argument --resume: cannot resume an output written to stdout')
+
+    if args.mode == 'eval':
+        evaluator = tc.Evaluator(
+            folds=args.folds,
+            hash_bits=args.hash_bits,
+            insensitive=not args.case_sensitive,
+            jobs=args.jobs,
+            max_df=args.max_df,
+            min_df=args.min_df,
+            prefetcher=make_prefetcher(args),
+            seed=args.seed,
+            stemming=not args.no_stemming,
+            stop_words=not args.no_stop_words,
+            tokenizer=args.tokenizer,
+            token_cache=open_token_cache(args),
+            top_n=args.top_n,
+            verbose=args.verbose,
+        )
+        report = evaluator.evaluate(args.i)
+
+        if evaluator.token_cache is not None:
+            evaluator.token_cache.close()
+
+        print(evaluator.summary(report))
+
+        if args.o:
+            json.dump(report, args.o, indent=4)
+            args.o.write('\n')
+    elif args.mode == 'merge':
+        merger = tc.Merger(
+            jobs=args.jobs,
+            partial=args.partial,
+            verbose=args.verbose,
+        )
+        merger.merge(args.partials)
+        merger.dump(args.d)
+    elif args.mode == 'serve':
+        # asyncio is only needed, and only paid for, when serving
+        import asyncio
+        import server
+
+        tester = tc.Tester(verbose=args.verbose)
+        tester.load(args.d)
+
+        srv = server.Server(
+            tester.db,
+            max_batch=args.max_batch,
+            max_wait=args.max_wait / 1000,
+            verbose=args.verbose,
+        )
+
+        try:
+            asyncio.run(srv.serve(args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            pass
+    elif args.mode == 'train':
+        trainer = tc.Trainer(
+            hash_bits=args.hash_bits,
+            jobs=args.jobs,
+            max_df=args.max_df,
+            min_df=args.min_df,
+            partial=args.partial,
+            prefetcher=make_prefetcher(args),
+            save_stem_cache=args.save_stem_cache,
+            stem_cache_size=args.stem_cache_size,
+            tokenizer=args.tokenizer,
+            token_cache=open_token_cache(args),
+            top_n=args.top_n,
+            trace=args.trace,
+            verbose=args.verbose,
+        )
         trainer.train(args.i)
         trainer.dump(args.d)
+
+        if trainer.token_cache is not None:
+            trainer.token_cache.close()
+
+        if args.stats:
+            trainer.db.processor.stats.dump(args.stats)
     elif args.mode == 'test':
-        tester = tc.Tester(verbose=args.verbose)
+        tester = tc.Tester(
+            dedup=args.dedup,
+            jobs=args.jobs,
+            max_score=args.max_score,
+            prefetcher=make_prefetcher(args),
+            token_cache=open_token_cache(args),
+            trace=args.trace,
+            verbose=args.verbose,
+        )
         tester.load(args.d)
-        tester.test(args.i)
-        tester.write(args.o)
+
+        # keyed by the database contents, so a retrained or updated
+        # database never sees predictions made by its old self
+        if args.prediction_cache is not None:
+            tester.dedup            = True
+            tester.prediction_cache = predcache.PredictionCache(
+                args.prediction_cache,
+                predcache.fingerprint(args.d.name),
+            )
+
+        tester.stream(args.i, args.o, resume=args.resume)
+
+        if tester.token_cache is not None:
+            tester.token_cache.close()
+
+        if tester.prediction_cache is not None:
+            tester.prediction_cache.close()
+
+        if args.stats:
+            tester.db.processor.stats.dump(args.stats)
+    elif args.mode == 'update':
+        trainer = tc.Trainer(
+            jobs=args.jobs,
+            prefetcher=make_prefetcher(args),
+            token_cache=open_token_cache(args),
+            trace=args.trace,
+            verbose=args.verbose,
+        )
+        with open(args.d, 'rb') as f:
+            trainer.load(f)
+
+        trainer.update(args.i)
+
+        # the old database may still be mapped, so never write over it
+        with open(args.d + '.tmp', 'wb') as f:
+            trainer.dump(f)
+
+        os.replace(args.d + '.tmp', args.d)
+
+        if trainer.token_cache is not None:
+            trainer.token_cache.close()
+
+        if args.stats:
+            trainer.db.processor.stats.dump(args.stats)
     elif args.mode == 'testgen':
         testgenerator = tc.TestGenerator()
         testgenerator.gen(args.i, args.o)
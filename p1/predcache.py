@@ -0,0 +1,101 @@
+# predcache.py -- persistent prediction cache
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import sqlite3
+
+
+# The cache maps a database fingerprint and the digest of a document's
+# contents (see tokcache.digest()) to the predicted category.  Entries
+# of any other database are dropped on open, so retraining or updating
+# a database invalidates everything predicted with its old contents.
+
+# pending entries written per transaction
+FLUSH = 512
+
+
+def fingerprint(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+
+    return h.digest()
+
+
+class PredictionCache:
+    def __init__(self, path, fingerprint):
+        self.fingerprint = fingerprint
+        self.path        = path
+
+        self._pending = { }
+
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS predictions ('
+            'db BLOB NOT NULL, key BLOB NOT NULL, category TEXT NOT NULL, '
+            'PRIMARY KEY (db, key)'
+            ') WITHOUT ROWID'
+        )
+
+        with self._conn:
+            cur = self._conn.execute('DELETE FROM predictions WHERE db != ?', (fingerprint,))
+
+        self.invalidated = cur.rowcount
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                ((self.fingerprint, key, cat) for key, cat in self._pending.items()),
+            )
+
+        self._pending = { }
+
+    def get(self, key):
+        try:
+            return self._pending[key]
+        except KeyError:
+            pass
+
+        row = self._conn.execute(
+            'SELECT category FROM predictions WHERE db = ? AND key = ?',
+            (self.fingerprint, key),
+        ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def put(self, key, cat):
+        self._pending[key] = cat
+
+        if len(self._pending) >= FLUSH:
+            self.flush()
+
+    def stats(self):
+        self.flush()
+
+        entries = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+        return f'Prediction cache: {entries} entries, {self.invalidated} invalidated'
@@ -0,0 +1,170 @@
+# server.py -- text categorization server
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import math
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import tc
+
+
+# Requests and responses are newline delimited json objects:
+#
+#   request:  {"text": "..."} or {"path": "..."}
+#   response: {"category": "...", "score": 0.5} or {"error": "..."}
+#
+# Responses are written in request order, so a client may pipeline as
+# many requests over a connection as it likes.
+
+# longest accepted request line
+LIMIT = 1 << 24
+
+
+class Server:
+    def __init__(self, db, max_batch=64, max_wait=0.002, verbose=False):
+        self.db        = db
+        self.max_batch = max_batch
+        self.max_wait  = max_wait
+        self.scorer    = tc.Scorer.from_database(db)
+        self.verbose   = verbose
+
+        # the processor (and its stem cache) is not thread safe, so all
+        # batches are classified on a single worker thread
+        self._executor = ThreadPoolExecutor(1)
+        self._queue    = None
+
+    async def serve(self, host=None, port=None, path=None):
+        self._queue = asyncio.Queue()
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path, limit=LIMIT)
+        else:
+            server = await asyncio.start_server(self._handle, host, port, limit=LIMIT)
+
+        if self.verbose:
+            for sock in server.sockets:
+                print(f'Listening on: {sock.getsockname()}')
+
+        batcher = asyncio.create_task(self._batcher())
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown()
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch    = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            # collect whatever else arrives within the batching window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            if self.verbose:
+                print(f'Classifying batch: {len(batch)}')
+
+            # a failure answers this batch, it must never end the task
+            try:
+                results = await loop.run_in_executor(
+                    self._executor,
+                    self._classify,
+                    [req for (req, _) in batch],
+                )
+            except Exception as e:
+                print(f'Classification failed: {e!r}', file=sys.stderr)
+                results = [{'error': f'classification failed: {e}'}] * len(batch)
+
+            for (_, fut), result in zip(batch, results):
+                if not fut.cancelled():
+                    fut.set_result(result)
+
+    def _classify(self, reqs):
+        processor = self.db.processor
+
+        results = [None] * len(reqs)
+        rows    = [ ]
+        vecs    = [ ]
+        for i, req in enumerate(reqs):
+            try:
+                if 'text' in req:
+                    tokens = processor.normalize(req['text'])
+                else:
+                    tokens = processor.normalize_file(req['path'])
+            except Exception as e:
+                results[i] = {'error': str(e)}
+                continue
+
+            rows.append(i)
+            vecs.append(processor.gen_vec(tokens))
+
+        for i, (cat, score) in zip(rows, self.scorer.predict(vecs)):
+            results[i] = {
+                'category': cat,
+                'score':    None if math.isnan(score) else float(score),
+            }
+
+        return results
+
+    async def _handle(self, reader, writer):
+        loop    = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+
+        async def respond():
+            while (fut := await pending.get()) is not None:
+                try:
+                    writer.write(json.dumps(await fut).encode() + b'\n')
+                    await writer.drain()
+                except ConnectionError:
+                    return
+
+        responder = asyncio.create_task(respond())
+
+        try:
+            while line := await reader.readline():
+                fut = loop.create_future()
+
+                try:
+                    req = json.loads(line)
+                except json.JSONDecodeError as e:
+                    fut.set_result({'error': f'invalid request: {e}'})
+                else:
+                    if not isinstance(req, dict) or not ('text' in req or 'path' in req):
+                        fut.set_result({'error': 'request needs a text or path'})
+                    elif not isinstance(req.get('text', req.get('path')), str):
+                        fut.set_result({'error': 'text and path must be strings'})
+                    else:
+                        await self._queue.put((req, fut))
+
+                await pending.put(fut)
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
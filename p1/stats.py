@@ -0,0 +1,165 @@
+# stats.py -- text categorization instrumentation
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+
+
+class Histogram:
+    # latencies are bucketed by their bit length in nanoseconds, so a
+    # record is a couple of integer operations and buckets double in size
+    def __init__(self):
+        self.buckets = { }
+        self.count   = 0
+        self.max     = 0
+        self.min     = 0
+        self.total   = 0
+
+    def merge(self, other):
+        for bucket, cnt in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + cnt
+
+        if other.count:
+            self.max = max(self.max, other.max)
+            self.min = min(self.min, other.min) if self.count else other.min
+
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile
+        rank = p * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.max, (1 << bucket) - 1)
+
+        return self.max
+
+    def record(self, ns):
+        bucket = ns.bit_length()
+
+        try:
+            self.buckets[bucket] += 1
+        except KeyError:
+            self.buckets[bucket] = 1
+
+        if not self.count or ns < self.min:
+            self.min = ns
+
+        if ns > self.max:
+            self.max = ns
+
+        self.count += 1
+        self.total += ns
+
+    def report(self):
+        return {
+            'count':    self.count,
+            'max_ns':   self.max,
+            'mean_ns':  self.total / self.count if self.count else 0.0,
+            'min_ns':   self.min,
+            'p50_ns':   self.percentile(0.50),
+            'p90_ns':   self.percentile(0.90),
+            'p99_ns':   self.percentile(0.99),
+            'total_ns': self.total,
+        }
+
+
+class Stats:
+    # stages in pipeline order, used to order the summary
+    STAGES = (
+        'read',
+        'io_wait',
+        'dedup',
+        'cache',
+        'tokenize',
+        'stem',
+        'stopword',
+        'vectorize',
+        'norm',
+        'score',
+    )
+
+    def __init__(self):
+        self.counters = { }
+        self.stages   = { }
+
+    def count(self, name, n=1):
+        try:
+            self.counters[name] += n
+        except KeyError:
+            self.counters[name] = n
+
+    def drain(self):
+        delta = (self.counters, self.stages)
+
+        self.counters = { }
+        self.stages   = { }
+
+        return delta
+
+    def dump(self, file):
+        json.dump(self.report(), file, indent=4)
+        file.write('\n')
+
+    def merge(self, delta):
+        counters, stages = delta
+
+        for name, n in counters.items():
+            self.count(name, n)
+
+        for name, hist in stages.items():
+            try:
+                self.stages[name].merge(hist)
+            except KeyError:
+                self.stages[name] = Histogram()
+                self.stages[name].merge(hist)
+
+    def record(self, stage, ns):
+        try:
+            self.stages[stage].record(ns)
+        except KeyError:
+            self.stages[stage] = Histogram()
+            self.stages[stage].record(ns)
+
+    def report(self):
+        return {
+            'counters': dict(sorted(self.counters.items())),
+            'stages':   {name: self.stages[name].report() for name in self._order()},
+        }
+
+    def summary(self):
+        total = sum(hist.total for hist in self.stages.values())
+
+        lines = [f'{"stage":<10} {"count":>9} {"total ms":>10} {"share":>7} {"p50 us":>9} {"p99 us":>9}']
+        for name in self._order():
+            hist = self.stages[name]
+            lines.append(
+                f'{name:<10} {hist.count:>9} {hist.total / 1e6:>10.1f} '
+                f'{hist.total / total if total else 0.0:>7.1%} '
+                f'{hist.percentile(0.50) / 1e3:>9.1f} {hist.percentile(0.99) / 1e3:>9.1f}'
+            )
+
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{name + ":":<16} {n}')
+
+        return '\n'.join(lines)
+
+    def _order(self):
+        known = [name for name in self.STAGES if name in self.stages]
+
+        return known + sorted(name for name in self.stages if name not in self.STAGES)
@@ -14,13 +14,149 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
+import functools
+import heapq
+import itertools
 import math
+import multiprocessing
+import os
 import pickle
 import random
+import re
+import sys
+import time
+import zlib
 
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import stats
+import tcdb
+import tokcache
+
+
+# A single pass approximation of word_tokenize().  Like the Treebank
+# tokenizer, only a fixed set of symbols is split off a word: commas and
+# colons are kept between digits, periods are kept inside a word, and
+# contractions and clitics become tokens of their own ("don't" -> "do",
+# "n't").  Unlike Punkt, every period ending a word is split off.
+_FAST_BODY    = r"""[^\s,;:@#$%&?!*()\[\]{}<>"'`.\-]"""
+_FAST_PART    = rf"""(?:{_FAST_BODY}|[,:](?=\d)|\.(?={_FAST_BODY})|-(?!-)|(?<=\w)'(?=\w))"""
+_FAST_CLITIC  = rf"""(?:n't|'(?:s|m|d|ll|re|ve))(?!{_FAST_BODY})"""
+_FAST_QUOTE_L = re.compile(r'(?:^|(?<=[\s(\[{<]))"')
+_FAST_QUOTE_R = re.compile(r'"')
+_FAST_TOKEN   = re.compile(
+    rf"""
+        {_FAST_PART}+?(?={_FAST_CLITIC})
+      | {_FAST_CLITIC}
+      | can(?=not\b)
+      | {_FAST_PART}+
+      | \.\.\.
+      | --
+      | ``
+      | ''
+      | \S
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+TOKENIZERS = ('fast', 'nltk')
+
+
+def fast_tokenize(string):
+    string = _FAST_QUOTE_L.sub(' `` ', string)
+    string = _FAST_QUOTE_R.sub(" '' ", string)
+
+    return _FAST_TOKEN.findall(string)
+
+
+# Importing nltk takes longer than everything else put together, so it
+# is only imported once a feature that needs it is actually used.
+
+@functools.cache
+def nltk_porter_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+
+@functools.cache
+def nltk_stopwords():
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
+@functools.cache
+def nltk_word_tokenize():
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
+
+
+# per worker processor and token cache, see Processor._pool_map()
+_cache     = None
+_processor = None
+
+# per worker documents and settings, see Evaluator.evaluate()
+_eval_docs     = None
+_eval_settings = None
+
+
+def _call_chunk(func, items):
+    return [func(item) for item in items]
+
+
+def _count_file(path):
+    return _processor.count_file(path, _cache), _drain_worker()
+
+
+def _count_string(string):
+    return _processor.count_string(string, _cache), _drain_worker()
+
+
+def _eval_fold(fold):
+    return Evaluator.run_fold(_eval_docs, fold, _eval_settings)
+
+
+def _drain_worker():
+    return (
+        _processor.stem_cache.drain(),
+        _processor.stats.drain(),
+        _cache.drain() if _cache is not None else None,
+    )
+
+
+def _init_eval_worker(docs, settings):
+    global _eval_docs, _eval_settings
+    _eval_docs     = docs
+    _eval_settings = settings
+
+
+def _init_worker(settings, stems, stopwords, cache_path):
+    global _cache, _processor
+    _processor = Processor(**settings)
+    _processor.stem_cache.update(stems)
+
+    if stopwords is not None:
+        _processor.stopwords = stopwords
+
+    # workers only read the cache, new entries are written by the parent
+    if cache_path is not None:
+        _cache = tokcache.TokenCache(cache_path, writer=False)
+
+
+def _merge_pair(pair):
+    return Merger.merge_pair(*pair)
+
+
+def _read_file(path):
+    start = time.perf_counter_ns()
+
+    f = open(path, 'r')
+    string = f.read()
+    f.close()
+
+    return string, time.perf_counter_ns() - start
 
 
 class Collection:
@@ -34,7 +170,9 @@ class Collection:
         self._cached   = False
         self._doc_cnt += 1
 
-        for word in set(tokens):
+        # unlike set(), keeps the words in first occurrence order so
+        # that the vocabulary of a trained database is reproducible
+        for word in dict.fromkeys(tokens):
             try:
                 self._doc_frq[word] += 1
             except KeyError:
@@ -78,74 +216,1035 @@ class Collection:
 
 
 class Database:
+    # tcdb.File backing a database opened with load()
+    mapped = None
+
+    # raw counts only, see Merger
+    partial = False
+
+    # statistics of Trainer.prune(), if the database was pruned
+    pruning = None
+
     def __init__(self):
+        self.cat_cnt    = { }
         self.cat_norm   = { }
         self.cat_vec    = { }
         self.collection = Collection()
         self.processor  = Processor()
 
+    def __getattr__(self, name):
+        # mapped databases only build their dicts when something asks
+        if name not in ('cat_cnt', 'cat_norm', 'cat_vec', 'collection') or self.mapped is None:
+            raise AttributeError(name)
+
+        self._materialize()
+
+        return self.__dict__[name]
+
+    # on-disk types of the arrays built by compile()
+    DTYPES = {
+        'cat_cnt':  '<i4',
+        'cat_idx':  '<u4',
+        'cat_norm': '<f4',
+        'cat_ptr':  '<u8',
+        'cat_wgt':  '<f4',
+        'doc_frq':  '<u4',
+        'idf':      '<f4',
+        'post_cat': '<u4',
+        'post_max': '<f4',
+        'post_ptr': '<i8',
+        'post_wgt': '<f4',
+    }
+
+    def compile(self):
+        collection = self.collection
+
+        if not collection._cached:
+            collection.cache()
+
+        if self.processor.hasher is not None:
+            return self._compile_hashed()
+
+        terms = list(collection._doc_frq)
+        vocab = { }
+        for word in terms:
+            vocab[word] = len(vocab)
+
+        # raw counts share the sparsity pattern of the category vectors
+        cat_cnt    = getattr(self, 'cat_cnt', None)
+        categories = list(self.cat_vec)
+        cat_frq    = [ ]
+        cat_ptr    = np.zeros(len(categories) + 1, dtype=np.int64)
+        cat_idx    = [ ]
+        cat_wgt    = [ ]
+        for i, cat in enumerate(categories):
+            for word, tf in self.cat_vec[cat].items():
+                cat_idx.append(vocab[word])
+                cat_wgt.append(tf)
+
+                if cat_cnt:
+                    cat_frq.append(cat_cnt[cat][word])
+
+            cat_ptr[i + 1] = len(cat_idx)
+
+        arrays = {
+            'cat_idx':  np.array(cat_idx, dtype=np.int64),
+            'cat_norm': np.array([self.cat_norm[cat] for cat in categories], dtype=np.float64),
+            'cat_ptr':  cat_ptr,
+            'cat_wgt':  np.array(cat_wgt, dtype=np.float64),
+            'doc_frq':  np.array([collection._doc_frq[word] for word in terms], dtype=np.int64),
+            'idf':      np.array([collection._idf[word] for word in terms], dtype=np.float64),
+        }
+
+        if cat_cnt:
+            arrays['cat_cnt'] = np.array(cat_frq, dtype=np.int64)
+
+        arrays.update(Scorer.index(
+            arrays['idf'],
+            arrays['cat_ptr'],
+            arrays['cat_idx'],
+            arrays['cat_wgt'],
+            arrays['cat_norm'],
+        ))
+
+        return terms, vocab, categories, arrays
+
+    def _compile_hashed(self):
+        collection = self.collection
+
+        # category vectors only hold non-zero buckets, see Hasher.gen_tf()
+        categories = list(self.cat_vec)
+        cat_frq    = [ ]
+        cat_ptr    = np.zeros(len(categories) + 1, dtype=np.int64)
+        cat_idx    = [ ]
+        cat_wgt    = [ ]
+        for i, cat in enumerate(categories):
+            cnt = self.cat_cnt[cat]
+            vec = self.cat_vec[cat]
+
+            for bucket in sorted(vec):
+                cat_idx.append(bucket)
+                cat_wgt.append(vec[bucket])
+                cat_frq.append(cnt[bucket])
+
+            cat_ptr[i + 1] = len(cat_idx)
+
+        arrays = {
+            'cat_cnt':  np.array(cat_frq, dtype=np.int64),
+            'cat_idx':  np.array(cat_idx, dtype=np.int64),
+            'cat_norm': np.array([self.cat_norm[cat] for cat in categories], dtype=np.float64),
+            'cat_ptr':  cat_ptr,
+            'cat_wgt':  np.array(cat_wgt, dtype=np.float64),
+            'doc_frq':  collection._doc_frq,
+            'idf':      collection._idf,
+        }
+
+        arrays.update(Scorer.index(
+            arrays['idf'],
+            arrays['cat_ptr'],
+            arrays['cat_idx'],
+            arrays['cat_wgt'],
+            arrays['cat_norm'],
+        ))
+
+        return None, None, categories, arrays
+
+    def dump(self, file, partial=False):
+        if partial:
+            terms, categories, arrays = self._compile_partial()
+        else:
+            terms, _, categories, arrays = self.compile()
+
+        meta = {
+            'categories': categories,
+            'doc_cnt':    self.collection._doc_cnt,
+            'processor':  self.processor.settings(),
+            'stem_cache': self.processor.stem_cache.stems(),
+        }
+
+        if partial:
+            meta['partial'] = True
+
+        # testing then needs neither nltk nor its corpora for them
+        if self.processor.stop_words:
+            meta['stopwords'] = sorted(self.processor.stopwords)
+
+        if self.pruning is not None:
+            meta['pruning'] = self.pruning
+
+        for name, array in arrays.items():
+            arrays[name] = array.astype(self.DTYPES[name])
+
+        if terms is not None:
+            arrays.update(tcdb.build_vocabulary(terms))
+
+        tcdb.write(file, meta, arrays)
+
+    @classmethod
+    def load(cls, file):
+        # databases written before tcdb are plain pickles
+        if not tcdb.is_tcdb(file):
+            return pickle.load(file)
+
+        mapped = tcdb.File(file)
+
+        db = cls.__new__(cls)
+        db.mapped    = mapped
+        db.processor = Processor(**mapped.meta['processor'])
+        db.pruning   = mapped.meta.get('pruning')
+        db.processor.stem_cache.update(mapped.meta['stem_cache'])
+
+        if 'stopwords' in mapped.meta:
+            db.processor.stopwords = mapped.meta['stopwords']
+
+        # partials are only ever merged, so they are read in right away
+        # and the file is not kept mapped
+        if mapped.meta.get('partial'):
+            db.partial = True
+            db._materialize_partial()
+            db.mapped = None
+
+        return db
+
+    def merge(self, other):
+        processor = self.processor
+
+        if (processor.norm_settings(), processor.settings()['hash_bits']) != (
+            other.processor.norm_settings(),
+            other.processor.settings()['hash_bits'],
+        ):
+            raise ValueError('databases were trained with different settings')
+
+        if self.pruning is not None or other.pruning is not None:
+            raise ValueError('pruned databases cannot be merged')
+
+        collection = self.collection
+        collection._cached   = False
+        collection._doc_cnt += other.collection._doc_cnt
+
+        # document frequencies are a dense array for hashed databases,
+        # category counts are always dicts keyed by term or bucket; either
+        # way the terms and categories of self come first
+        if processor.hasher is not None:
+            collection._doc_frq += other.collection._doc_frq
+        else:
+            doc_frq = collection._doc_frq
+            for word, frq in other.collection._doc_frq.items():
+                try:
+                    doc_frq[word] += frq
+                except KeyError:
+                    doc_frq[word] = frq
+
+        for cat, other_cnt in other.cat_cnt.items():
+            try:
+                cnt = self.cat_cnt[cat]
+            except KeyError:
+                cnt = self.cat_cnt[cat] = { }
+
+            for word, frq in other_cnt.items():
+                try:
+                    cnt[word] += frq
+                except KeyError:
+                    cnt[word] = frq
+
+    def _compile_partial(self):
+        collection = self.collection
+        hashed     = self.processor.hasher is not None
+
+        categories = list(self.cat_cnt)
+        cat_ptr    = np.zeros(len(categories) + 1, dtype=np.int64)
+        cat_idx    = [ ]
+        cat_frq    = [ ]
+
+        if hashed:
+            terms = None
+            for i, cat in enumerate(categories):
+                cnt = self.cat_cnt[cat]
+
+                # colliding terms may have cancelled a bucket out
+                for bucket in sorted(cnt):
+                    if cnt[bucket]:
+                        cat_idx.append(bucket)
+                        cat_frq.append(cnt[bucket])
+
+                cat_ptr[i + 1] = len(cat_idx)
+
+            doc_frq = collection._doc_frq
+        else:
+            terms = list(collection._doc_frq)
+            vocab = { }
+            for word in terms:
+                vocab[word] = len(vocab)
+
+            for i, cat in enumerate(categories):
+                for word, frq in self.cat_cnt[cat].items():
+                    cat_idx.append(vocab[word])
+                    cat_frq.append(frq)
+
+                cat_ptr[i + 1] = len(cat_idx)
+
+            doc_frq = np.array([collection._doc_frq[word] for word in terms], dtype=np.int64)
+
+        arrays = {
+            'cat_cnt': np.array(cat_frq, dtype=np.int64),
+            'cat_idx': np.array(cat_idx, dtype=np.int64),
+            'cat_ptr': cat_ptr,
+            'doc_frq': doc_frq,
+        }
+
+        return terms, categories, arrays
+
+    def _materialize_partial(self):
+        arrays  = self.mapped.arrays
+        hasher  = self.processor.hasher
+        meta    = self.mapped.meta
+        cat_idx = arrays['cat_idx'].tolist()
+        cat_ptr = arrays['cat_ptr'].tolist()
+        cat_frq = arrays['cat_cnt'].tolist()
+
+        # neither idfs nor weights exist until the partials are merged
+        if hasher is not None:
+            collection = HashedCollection(hasher.buckets)
+            collection._doc_frq = arrays['doc_frq'].astype(np.int64)
+        else:
+            terms      = list(self.mapped.vocabulary())
+            collection = Collection()
+            collection._doc_frq = dict(zip(terms, arrays['doc_frq'].tolist()))
+
+        collection._cached  = False
+        collection._doc_cnt = meta['doc_cnt']
+
+        cat_cnt = { }
+        for i, cat in enumerate(meta['categories']):
+            lo = cat_ptr[i]
+            hi = cat_ptr[i + 1]
+
+            if hasher is not None:
+                cat_cnt[cat] = dict(zip(cat_idx[lo:hi], cat_frq[lo:hi]))
+            else:
+                cat_cnt[cat] = dict(zip([terms[j] for j in cat_idx[lo:hi]], cat_frq[lo:hi]))
+
+        self.cat_cnt    = cat_cnt
+        self.cat_norm   = { }
+        self.cat_vec    = { }
+        self.collection = collection
+
+    def _materialize(self):
+        if self.processor.hasher is not None:
+            return self._materialize_hashed()
+
+        arrays = self.mapped.arrays
+        meta   = self.mapped.meta
+        terms  = list(self.mapped.vocabulary())
+
+        collection = Collection()
+        collection._doc_cnt = meta['doc_cnt']
+        collection._doc_frq = dict(zip(terms, arrays['doc_frq'].tolist()))
+        collection.cache()
+
+        cat_idx  = arrays['cat_idx'].tolist()
+        cat_ptr  = arrays['cat_ptr'].tolist()
+        cat_wgt  = arrays['cat_wgt'].tolist()
+        cat_frq  = arrays['cat_cnt'].tolist() if 'cat_cnt' in arrays else None
+        cat_cnt  = { } if cat_frq else None
+        cat_norm = { }
+        cat_vec  = { }
+        for i, cat in enumerate(meta['categories']):
+            vec = { }
+            for j in range(cat_ptr[i], cat_ptr[i + 1]):
+                vec[terms[cat_idx[j]]] = cat_wgt[j]
+
+            # prefer exact weights over the stored float32 ones
+            if cat_frq:
+                cnt = { }
+                for j in range(cat_ptr[i], cat_ptr[i + 1]):
+                    cnt[terms[cat_idx[j]]] = cat_frq[j]
+
+                cat_cnt[cat] = cnt
+                vec = self.processor.gen_tf(cnt)
+
+            cat_vec[cat]  = vec
+            cat_norm[cat] = collection.norm(vec)
+
+        self.cat_cnt    = cat_cnt
+        self.cat_norm   = cat_norm
+        self.cat_vec    = cat_vec
+        self.collection = collection
+
+    def _materialize_hashed(self):
+        arrays = self.mapped.arrays
+        hasher = self.processor.hasher
+        meta   = self.mapped.meta
+
+        collection = HashedCollection(hasher.buckets)
+        collection._doc_cnt = meta['doc_cnt']
+        collection._doc_frq = arrays['doc_frq'].astype(np.int64)
+        collection.cache()
+
+        cat_idx  = arrays['cat_idx'].tolist()
+        cat_ptr  = arrays['cat_ptr'].tolist()
+        cat_frq  = arrays['cat_cnt'].tolist()
+        cat_cnt  = { }
+        cat_norm = { }
+        cat_vec  = { }
+        for i, cat in enumerate(meta['categories']):
+            lo = cat_ptr[i]
+            hi = cat_ptr[i + 1]
+
+            cat_cnt[cat]  = dict(zip(cat_idx[lo:hi], cat_frq[lo:hi]))
+            cat_vec[cat]  = hasher.gen_tf(cat_cnt[cat])
+            cat_norm[cat] = collection.norm(cat_vec[cat])
+
+        self.cat_cnt    = cat_cnt
+        self.cat_norm   = cat_norm
+        self.cat_vec    = cat_vec
+        self.collection = collection
+
+
+class Evaluator:
+    def __init__(
+        self,
+        folds=5,
+        insensitive=True,
+        stemming=True,
+        stop_words=True,
+        jobs=1,
+        prefetcher=None,
+        seed=None,
+        tokenizer='nltk',
+        token_cache=None,
+        verbose=False,
+        hash_bits=0,
+        min_df=1,
+        max_df=1.0,
+        top_n=0,
+    ):
+        if folds < 2:
+            raise ValueError(f'at least two folds are needed: {folds}')
+
+        self.folds       = folds
+        self.jobs        = jobs
+        self.pruning     = {'max_df': max_df, 'min_df': min_df, 'top_n': top_n}
+        self.prefetcher  = prefetcher
+        self.processor   = Processor(
+            insensitive,
+            stemming,
+            stop_words,
+            tokenizer=tokenizer,
+            hash_bits=hash_bits,
+        )
+        self.seed        = seed
+        self.token_cache = token_cache
+        self.verbose     = verbose
+
+    def evaluate(self, labels):
+        processor = self.processor
+        start     = time.perf_counter()
+
+        if self.verbose:
+            print(
+                f'Evaluating with...\n'
+                f'Folds:       {self.folds}\n'
+                f'Insensitive: {processor.insensitive}\n'
+                f'Stemming:    {processor.stemming}\n'
+                f'Stop Words:  {processor.stop_words}\n'
+                f'Tokenizer:   {processor.tokenizer}\n'
+                f'Hash Bits:   {processor.settings()["hash_bits"]}\n'
+                f'---'
+            )
+
+        # every document is normalized exactly once and its counts are
+        # shared by all folds
+        tuples = processor.gen_cat_file_tuples(labels)
+        paths  = (path for (_, path) in tuples)
+        cnts   = processor.count_files(
+            paths,
+            self.jobs,
+            cache=self.token_cache,
+            prefetcher=self.prefetcher,
+        )
+
+        docs = [ ]
+        for (cat, path), cnt in zip(tuples, cnts):
+            docs.append((cat, path, cnt))
+
+        normalized = time.perf_counter()
+
+        if self.verbose:
+            print(f'Normalized {len(docs)} documents in {normalized - start:.3f}s')
+
+        # a shuffled round robin keeps the folds within one document of
+        # each other in size
+        order = list(range(len(docs)))
+        random.Random(self.seed).shuffle(order)
+
+        fold_of = [0] * len(docs)
+        for i, doc in enumerate(order):
+            fold_of[doc] = i % self.folds
+
+        folds    = [(k, fold_of) for k in range(self.folds)]
+        settings = {**processor.settings(), **self.pruning}
+        if self.jobs <= 1:
+            results = [Evaluator.run_fold(docs, fold, settings) for fold in folds]
+        else:
+            initargs = (docs, settings)
+            with multiprocessing.Pool(min(self.jobs, self.folds), _init_eval_worker, initargs) as pool:
+                results = pool.map(_eval_fold, folds)
+
+        report = self.report(docs, results)
+        report['timing'] = {
+            'folds':     [result['timing'] for result in results],
+            'normalize': normalized - start,
+            'total':     time.perf_counter() - start,
+        }
+        report['pruning']  = [result['pruning'] for result in results]
+        report['settings'] = {
+            'folds':       self.folds,
+            'hash_bits':   settings['hash_bits'],
+            'insensitive': processor.insensitive,
+            'max_df':      settings['max_df'],
+            'min_df':      settings['min_df'],
+            'seed':        self.seed,
+            'stemming':    processor.stemming,
+            'stop_words':  processor.stop_words,
+            'tokenizer':   processor.tokenizer,
+            'top_n':       settings['top_n'],
+        }
+
+        return report
+
+    @staticmethod
+    def summary(report):
+        lines = [f'{"category":<16} {"precision":>9} {"recall":>9} {"f1":>9} {"support":>9}']
+        for cat, c in report['categories'].items():
+            lines.append(
+                f'{cat:<16} {c["precision"]:>9.4f} {c["recall"]:>9.4f} '
+                f'{c["f1"]:>9.4f} {c["support"]:>9}'
+            )
+
+        timing = report['timing']
+        lines += [
+            f'',
+            f'Micro F1:  {report["micro_f1"]:.4f}',
+            f'Macro F1:  {report["macro_f1"]:.4f}',
+            f'Folds:     {" ".join(f"{acc:.4f}" for acc in report["folds"])}',
+        ]
+
+        # pruning statistics averaged over the folds
+        pruning = [fold for fold in report['pruning'] if fold is not None]
+        if pruning:
+            def mean(name):
+                return sum(fold[name] for fold in pruning) / len(pruning)
+
+            lines += [
+                f'Terms:     {mean("terms_before"):.0f} -> {mean("terms_after"):.0f}',
+                f'Weights:   {mean("weights_before"):.0f} -> {mean("weights_after"):.0f}',
+            ]
+
+        lines += [
+            f'Normalize: {timing["normalize"]:.3f}s',
+            f'Train:     {sum(fold["train"] for fold in timing["folds"]):.3f}s (all folds)',
+            f'Test:      {sum(fold["test"] for fold in timing["folds"]):.3f}s (all folds)',
+            f'Total:     {timing["total"]:.3f}s',
+        ]
+
+        return '\n'.join(lines)
+
+    def report(self, docs, results):
+        # true positives, false positives and false negatives by category
+        counts = { }
+        for (cat, _, _) in docs:
+            counts[cat] = [0, 0, 0]
+
+        folds = [ ]
+        for result in results:
+            correct = 0
+            for i, predicted in result['predicted']:
+                actual = docs[i][0]
+                if predicted == actual:
+                    counts[actual][0] += 1
+                    correct           += 1
+                else:
+                    counts.setdefault(predicted, [0, 0, 0])[1] += 1
+                    counts[actual][2]                          += 1
+
+            folds.append(correct / len(result['predicted']) if result['predicted'] else 0.0)
+
+        categories = { }
+        for cat, (tp, fp, fn) in sorted(counts.items()):
+            precision = tp / (tp + fp) if tp + fp else 0.0
+            recall    = tp / (tp + fn) if tp + fn else 0.0
+
+            categories[cat] = {
+                'f1':        2 * precision * recall / (precision + recall) if tp else 0.0,
+                'precision': precision,
+                'recall':    recall,
+                'support':   tp + fn,
+            }
+
+        # documents carry a single label, so micro f1 is the accuracy
+        tp = sum(tp for (tp, _, _) in counts.values())
+
+        return {
+            'categories': categories,
+            'folds':      folds,
+            'macro_f1':   sum(c['f1'] for c in categories.values()) / len(categories) if categories else 0.0,
+            'micro_f1':   tp / len(docs) if docs else 0.0,
+        }
+
+    @staticmethod
+    def run_fold(docs, fold, settings):
+        k, fold_of = fold
+        start      = time.perf_counter()
+
+        trainer = Trainer(
+            insensitive=settings['insensitive'],
+            stemming=settings['stemming'],
+            stop_words=settings['stop_words'],
+            tokenizer=settings['tokenizer'],
+            hash_bits=settings['hash_bits'],
+            min_df=settings['min_df'],
+            max_df=settings['max_df'],
+            top_n=settings['top_n'],
+        )
+        trainer._finalize(trainer._add_counts(
+            ((cat, path), cnt) for i, (cat, path, cnt) in enumerate(docs) if fold_of[i] != k
+        ))
+
+        if trainer.min_df > 1 or trainer.max_df < 1 or trainer.top_n:
+            trainer.prune()
+
+        # score against the on-disk precision so that the predictions
+        # match those of a dumped database
+        db                           = trainer.db
+        _, vocab, categories, arrays = db.compile()
+        for name, array in arrays.items():
+            arrays[name] = array.astype(Database.DTYPES[name])
+
+        arrays['nan_cats'] = arrays['cat_norm'] == 0
+
+        scorer  = Scorer(vocab, arrays['idf'], categories, arrays)
+        trained = time.perf_counter()
+
+        held = [i for i in range(len(docs)) if fold_of[i] == k]
+        vecs = [db.processor.gen_tf(docs[i][2]) for i in held]
+
+        predicted = [ ]
+        for i, (cat, _) in zip(held, scorer.predict(vecs)):
+            predicted.append((i, cat))
+
+        return {
+            'predicted': predicted,
+            'pruning':   db.pruning,
+            'timing': {
+                'test':  time.perf_counter() - trained,
+                'train': trained - start,
+            },
+        }
+
+
+class HashedCollection:
+    # Collection over hashed buckets, every statistic is a dense array
+    # while vectors stay dicts keyed by bucket
+    def __init__(self, buckets):
+        self._cached  = True
+        self._doc_cnt = 0
+        self._doc_frq = np.zeros(buckets, dtype=np.int64)
+        self._idf     = np.zeros(buckets)
+
+    def add_doc(self, ids):
+        self._cached   = False
+        self._doc_cnt += 1
+
+        # ids are unique within a document, see Hasher.bucket()
+        self._doc_frq[ids] += 1
+
+    def cache(self):
+        seen = self._doc_frq > 0
+
+        self._idf       = np.zeros(len(self._doc_frq))
+        self._idf[seen] = np.log10(self._doc_cnt / self._doc_frq[seen])
+
+        self._cached = True
+
+    def norm(self, vec):
+        if not self._cached:
+            self.cache()
+
+        ids = np.fromiter(vec, np.int64, len(vec))
+        wgt = np.fromiter(vec.values(), np.float64, len(vec)) * self._idf[ids]
+
+        return math.sqrt(wgt @ wgt)
+
+
+class Hasher:
+    # the hashing trick: a term is counted in bucket crc32 & mask with
+    # the sign taken from the top bit, so that colliding terms cancel
+    # out on average instead of always adding up
+    def __init__(self, bits=20):
+        if not 1 <= bits <= 30:
+            raise ValueError(f'hash bits must be between 1 and 30: {bits}')
+
+        self.bits    = bits
+        self.buckets = 1 << bits
+
+    def bucket(self, cnt):
+        n      = len(cnt)
+        hashes = np.fromiter((zlib.crc32(word.encode()) for word in cnt), np.int64, n)
+        signs  = 1 - 2 * (hashes >> 31)
+        counts = np.fromiter(cnt.values(), np.int64, n) * signs
+
+        ids, inverse = np.unique(hashes & (self.buckets - 1), return_inverse=True)
+        sums         = np.bincount(inverse, weights=counts, minlength=len(ids)).astype(np.int64)
+        keep         = sums != 0
+
+        return ids[keep], sums[keep]
+
+    def gen_tf(self, cnt):
+        # bucket counts to bucket weights, cancelled out buckets are dropped
+        ids  = np.fromiter(cnt, np.int64, len(cnt))
+        sums = np.fromiter(cnt.values(), np.int64, len(cnt))
+        keep = sums != 0
+
+        return dict(zip(ids[keep].tolist(), self.tf(sums[keep]).tolist()))
+
+    def tf(self, cnt):
+        # the signed counterpart of Processor.gen_tf()
+        return np.sign(cnt) * np.log10(np.abs(cnt) + 1)
+
+
+class Merger:
+    def __init__(self, jobs=1, partial=False, verbose=False):
+        self.db      = None
+        self.jobs    = jobs
+        self.partial = partial
+        self.verbose = verbose
+
+    def dump(self, file):
+        if self.verbose:
+            print(f'Dumping database to file: {file.name}')
+
+        # stem caches cannot be meaningfully combined
+        self.db.processor.stem_cache.clear()
+        self.db.dump(file, partial=self.partial)
+
+    def merge(self, paths):
+        # a tree reduction over neighbouring pairs, which keeps terms and
+        # categories in first occurrence order, so merging the partials
+        # of consecutive shards matches training on all of them at once
+        level = list(paths)
+        pool  = multiprocessing.Pool(self.jobs) if self.jobs > 1 and len(level) > 2 else None
+        try:
+            while len(level) > 1:
+                if self.verbose:
+                    print(f'Merging {len(level)} databases')
+
+                pairs = [level[i:i + 2] for i in range(0, len(level) - 1, 2)]
+                odd   = level[len(pairs) * 2:]
+
+                if pool is not None:
+                    level = pool.map(_merge_pair, pairs)
+                else:
+                    level = [Merger.merge_pair(*pair) for pair in pairs]
+
+                level += odd
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.db = Merger.open(level[0])
+
+        if self.partial:
+            return
+
+        if self.verbose:
+            print(f'Finalizing {self.db.collection._doc_cnt} documents')
+
+        trainer    = Trainer(verbose=self.verbose)
+        trainer.db = self.db
+        trainer._finalize(self.db.cat_cnt)
+
+        self.db.partial = False
+
+    @staticmethod
+    def merge_pair(a, b):
+        a = Merger.open(a)
+        a.merge(Merger.open(b))
+
+        return a
+
+    @staticmethod
+    def open(db):
+        # the leaves of the reduction are paths, inner nodes databases
+        if isinstance(db, Database):
+            return db
+
+        with open(db, 'rb') as f:
+            loaded = Database.load(f)
+
+        if not loaded.partial:
+            raise ValueError(f'not a partial database: {db}')
+
+        return loaded
+
+
+class Prefetcher:
+    def __init__(self, threads=4, depth=64):
+        if threads < 1 or depth < 1:
+            raise ValueError(f'prefetching needs a thread and a slot: {threads}, {depth}')
+
+        self.depth   = depth
+        self.threads = threads
+
+    def read(self, paths, stats=None):
+        # reads run ahead on a thread pool, at most depth files at a
+        # time, while contents are handed out in input order
+        with ThreadPoolExecutor(self.threads) as executor:
+            pending = deque()
+            for path in paths:
+                pending.append(executor.submit(_read_file, path))
+
+                if len(pending) >= self.depth:
+                    yield self._take(pending.popleft(), stats)
+
+            while pending:
+                yield self._take(pending.popleft(), stats)
+
+    def _take(self, future, stats):
+        start = time.perf_counter_ns()
+        string, ns = future.result()
+
+        # time spent blocked on a read that had not finished yet
+        if stats is not None:
+            stats.record('io_wait', time.perf_counter_ns() - start)
+            stats.record('read', ns)
+            stats.count('chars_read', len(string))
+
+        return string
+
 
 class Processor:
-    def __init__(self, insensitive=False, stemming=False, stop_words=False):
-        self.insensitive    = insensitive
-        self.porter_stemmer = PorterStemmer()
-        self.stemming       = stemming
-        self.stop_words     = stop_words
-        self.stopwords      = stopwords.words('english')
+    def __init__(
+        self,
+        insensitive=False,
+        stemming=False,
+        stop_words=False,
+        stem_cache_size=65536,
+        tokenizer='nltk',
+        hash_bits=0,
+    ):
+        if tokenizer not in TOKENIZERS:
+            raise ValueError(f'unknown tokenizer: {tokenizer}')
 
-    def gen_cat_file_tuples(self, file):
-        tuples = [ ]
-        for line in file.readlines():
-            tmp = line.strip().split()
-            tmp.reverse()
-            tuples.append(tuple(tmp))
+        self.hasher      = Hasher(hash_bits) if hash_bits else None
+        self.insensitive = insensitive
+        self.stats       = stats.Stats()
+        self.stem_cache  = StemCache(stem_cache_size)
+        self.stemming    = stemming
+        self.stop_words  = stop_words
+        self.tokenizer   = tokenizer
 
-        return tuples
+        # loaded on first use, unless a database provides them
+        self._stopwords = None
 
-    def gen_file_list(self, file):
-        list = [ ]
-        for line in file.readlines():
-            list.append(line.strip())
+    def __setstate__(self, state):
+        # databases pickled before the stem cache or tokenizer existed
+        if 'stem_cache' not in state:
+            state['stem_cache'] = StemCache()
 
-        return list
+        # or while the stemmer and stop words were loaded eagerly
+        if 'porter_stemmer' in state:
+            del state['porter_stemmer']
+            state['_stopwords'] = frozenset(state.pop('stopwords'))
 
-    def gen_vec(self, tokens):
-        vec = { }
+        if 'hasher' not in state:
+            state['hasher'] = None
+
+        if 'stats' not in state:
+            state['stats'] = stats.Stats()
+
+        if 'tokenizer' not in state:
+            state['tokenizer'] = 'nltk'
+
+        self.__dict__.update(state)
+
+    @property
+    def porter_stemmer(self):
+        return nltk_porter_stemmer()
+
+    @property
+    def stopwords(self):
+        if self._stopwords is None:
+            self._stopwords = nltk_stopwords()
+
+        return self._stopwords
+
+    @stopwords.setter
+    def stopwords(self, words):
+        self._stopwords = frozenset(words)
+
+    def count_file(self, path, cache=None):
+        return self.count_string(self.read_file(path), cache)
+
+    def count_files(self, paths, jobs=1, chunksize=16, cache=None, prefetcher=None):
+        # with a prefetcher the contents are read here, ahead of the
+        # workers, rather than by the workers themselves
+        if prefetcher is not None:
+            yield from self.count_strings(prefetcher.read(paths, self.stats), jobs, chunksize, cache)
+            return
+
+        if jobs <= 1:
+            for path in paths:
+                yield self.count_file(path, cache)
+
+            return
+
+        yield from self._pool_map(_count_file, paths, jobs, chunksize, cache)
+
+    def count_string(self, string, cache=None):
+        if cache is None:
+            return self.gen_cnt(self.normalize(string))
+
+        start = time.perf_counter_ns()
+        key   = tokcache.digest(self.norm_settings(), string)
+        cnt   = cache.get(key)
+        self.stats.record('cache', time.perf_counter_ns() - start)
+
+        if cnt is not None:
+            self.stats.count('token_cache_hits')
+            return cnt
+
+        self.stats.count('token_cache_misses')
+
+        cnt = self.gen_cnt(self.normalize(string))
+        cache.put(key, cnt)
+
+        return cnt
+
+    def count_strings(self, strings, jobs=1, chunksize=16, cache=None):
+        if jobs <= 1:
+            for string in strings:
+                yield self.count_string(string, cache)
+
+            return
+
+        yield from self._pool_map(_count_string, strings, jobs, chunksize, cache)
+
+    def gen_cat_file_tuples(self, file):
+        return list(self.iter_cat_file_tuples(file))
+
+    def gen_cnt(self, tokens):
+        cnt = { }
 
         for word in tokens:
             try:
-                vec[word] += 1
+                cnt[word] += 1
             except KeyError:
-                vec[word] = 1
+                cnt[word] = 1
 
-        for word in vec:
-            vec[word] = math.log10(vec[word] + 1)
+        return cnt
+
+    def gen_file_list(self, file):
+        return list(self.iter_file_list(file))
+
+    def gen_tf(self, cnt):
+        # hashed vectors are keyed by bucket rather than by term
+        if self.hasher is not None:
+            ids, sums = self.hasher.bucket(cnt)
+            return dict(zip(ids.tolist(), self.hasher.tf(sums).tolist()))
+
+        vec = { }
+
+        for word, frq in cnt.items():
+            vec[word] = math.log10(frq + 1)
 
         return vec
 
+    def gen_vec(self, tokens):
+        return self.gen_tf(self.gen_cnt(tokens))
+
+    def iter_cat_file_tuples(self, file):
+        for line in file:
+            tmp = line.strip().split()
+            tmp.reverse()
+            yield tuple(tmp)
+
+    def iter_file_list(self, file):
+        for line in file:
+            yield line.strip()
+
     def normalize(self, string):
+        start = time.perf_counter_ns()
+
         if self.insensitive:
             string = string.lower()
 
-        tokens = word_tokenize(string)
+        if self.tokenizer == 'fast':
+            tokens = fast_tokenize(string)
+        else:
+            tokens = nltk_word_tokenize()(string)
+
+        end = time.perf_counter_ns()
+        self.stats.record('tokenize', end - start)
+        self.stats.count('documents')
+        self.stats.count('tokens', len(tokens))
 
         if self.stemming:
+            start = end
+
+            # a warm stem cache may never need the stemmer
             tmp = [ ]
             for word in tokens:
-                tmp.append(self.porter_stemmer.stem(word))
+                tmp.append(self.stem_cache.get(word, self._stem))
 
             tokens = tmp
 
+            end = time.perf_counter_ns()
+            self.stats.record('stem', end - start)
+
         if self.stop_words:
-            filtered = [ ]
+            start = end
+
+            stopwords = self.stopwords
+            filtered  = [ ]
             for word in tokens:
-                if word not in self.stopwords:
+                if word not in stopwords:
                     filtered.append(word)
 
             tokens = filtered
 
+            end = time.perf_counter_ns()
+            self.stats.record('stopword', end - start)
+            self.stats.count('tokens_kept', len(tokens))
+
         return tokens
 
+    def normalize_file(self, path):
+        return self.normalize(self.read_file(path))
+
+    def norm_settings(self):
+        # the settings that change the output of normalize()
+        return (self.insensitive, self.stemming, self.stop_words, self.tokenizer)
+
+    def read_file(self, path):
+        string, ns = _read_file(path)
+
+        self.stats.record('read', ns)
+        self.stats.count('chars_read', len(string))
+
+        return string
+
+    def settings(self):
+        return {
+            'hash_bits':       self.hasher.bits if self.hasher is not None else 0,
+            'insensitive':     self.insensitive,
+            'stem_cache_size': self.stem_cache.size,
+            'stemming':        self.stemming,
+            'stop_words':      self.stop_words,
+            'tokenizer':       self.tokenizer,
+        }
+
     def write_cat_file_tuples(self, tuples, file):
         for (cat, path) in tuples:
             file.write(f'{path} {cat}\n')
@@ -154,22 +1253,442 @@ class Processor:
         for (_, path) in tuples:
             file.write(f'{path}\n')
 
+    def _stem(self, word):
+        return nltk_porter_stemmer().stem(word)
+
+    def _pool_map(self, func, paths, jobs, chunksize, cache=None):
+        # workers build their own processor instead of receiving a
+        # pickled copy of the stemmer and stopwords with every task
+        initargs = (
+            self.settings(),
+            self.stem_cache.stems(),
+            self._stopwords,
+            cache.path if cache is not None else None,
+        )
+        with multiprocessing.Pool(jobs, _init_worker, initargs) as pool:
+            # Pool.imap() drains its input eagerly, so a bounded number
+            # of chunks is kept in flight instead, topped up as soon as
+            # the oldest is consumed, so that a slow document only holds
+            # back the results and never leaves the other workers idle
+            paths   = iter(paths)
+            pending = deque()
+            while True:
+                while len(pending) < jobs * 4 and (chunk := list(itertools.islice(paths, chunksize))):
+                    pending.append(pool.apply_async(_call_chunk, (func, chunk)))
+
+                if not pending:
+                    break
+
+                for result, (stem_delta, stats_delta, cache_delta) in pending.popleft().get():
+                    self.stem_cache.merge(stem_delta)
+                    self.stats.merge(stats_delta)
+
+                    if cache_delta is not None:
+                        cache.merge(cache_delta)
+
+                    yield result
+
+
+class Scorer:
+    def __init__(self, vocab, idf, categories, index, chunk_size=256):
+        self.categories = categories
+        self.chunk_size = chunk_size
+        self.idf        = idf
+        self.vocab      = vocab
+
+        self._nan_cats = index['nan_cats']
+        self._post_cat = index['post_cat']
+        self._post_max = index['post_max']
+        self._post_ptr = index['post_ptr']
+        self._post_wgt = index['post_wgt']
+
+    @classmethod
+    def from_database(cls, db, **kwargs):
+        if db.mapped is not None:
+            return cls.from_mapped(db.mapped, **kwargs)
+
+        _, vocab, categories, arrays = db.compile()
+        arrays['nan_cats'] = arrays['cat_norm'] == 0
+
+        return cls(vocab, arrays['idf'], categories, arrays, **kwargs)
+
+    @classmethod
+    def from_mapped(cls, mapped, **kwargs):
+        arrays = dict(mapped.arrays)
+
+        # databases written before the index was stored
+        if 'post_ptr' not in arrays:
+            arrays.update(cls.index(
+                arrays['idf'],
+                arrays['cat_ptr'].astype(np.int64),
+                arrays['cat_idx'],
+                arrays['cat_wgt'],
+                arrays['cat_norm'],
+            ))
+
+        arrays['nan_cats'] = arrays['cat_norm'] == 0
+
+        # hashed databases have no vocabulary, buckets are the term ids
+        vocab = mapped.vocabulary() if 'vocab_hash' in arrays else None
+
+        return cls(
+            vocab,
+            arrays['idf'],
+            mapped.meta['categories'],
+            arrays,
+            **kwargs,
+        )
+
+    @staticmethod
+    def index(idf, cat_ptr, cat_idx, cat_wgt, cat_norm):
+        cat_cnt  = len(cat_norm)
+        term_cnt = len(idf)
+
+        # zero norm categories always compare as nan, see Collection.sim()
+        scale = np.divide(
+            1.0,
+            cat_norm,
+            out=np.zeros(cat_cnt),
+            where=cat_norm != 0,
+        )
+
+        # inverted index from a term to the categories containing it with
+        # their tf * idf^2 / norm weight, so scoring a document is a sum
+        # over the postings of its terms; zero weights are never stored
+        rows = np.repeat(np.arange(cat_cnt), np.diff(cat_ptr))
+        wgt  = cat_wgt * idf[cat_idx].astype(np.float64) ** 2 * scale[rows]
+        keep = wgt != 0
+
+        rows = rows[keep]
+        idx  = cat_idx[keep]
+        wgt  = wgt[keep]
+
+        # a stable sort keeps the postings of a term ordered by category
+        order    = np.argsort(idx, kind='stable')
+        post_max = np.zeros(term_cnt)
+        post_ptr = np.zeros(term_cnt + 1, dtype=np.int64)
+
+        np.cumsum(np.bincount(idx, minlength=term_cnt), out=post_ptr[1:])
+        np.maximum.at(post_max, idx, wgt)
+
+        return {
+            'post_cat': rows[order],
+            'post_max': post_max,
+            'post_ptr': post_ptr,
+            'post_wgt': wgt[order],
+        }
+
+    def argmax(self, scores):
+        # mirror max(sim, key=sim.get): the first category wins ties and
+        # nan is never greater than anything, so a leading nan sticks
+        best = np.argmax(np.where(np.isnan(scores), -np.inf, scores), axis=1)
+        best[np.isnan(scores[:, 0])] = 0
+
+        return best
+
+    def predict(self, vecs):
+        predicted = [ ]
+        for i in range(0, len(vecs), self.chunk_size):
+            scores = self.score(vecs[i:i + self.chunk_size])
+            best   = self.argmax(scores)
+
+            for row, cat in enumerate(best):
+                predicted.append((self.categories[cat], scores[row, cat]))
+
+        return predicted
+
+    def score(self, vecs, stats=None):
+        rows    = [ ]
+        ids     = [ ]
+        weights = [ ]
+        nan_doc = np.zeros(len(vecs), dtype=bool)
+
+        for row, vec in enumerate(vecs):
+            began = time.perf_counter_ns()
+            doc_ids, doc_wgt = self._weigh(vec)
+
+            if stats is not None:
+                stats.record('norm', time.perf_counter_ns() - began)
+
+            if doc_ids is None:
+                nan_doc[row] = True
+                continue
+
+            rows.append(np.full(len(doc_ids), row))
+            ids.append(doc_ids)
+            weights.append(doc_wgt)
+
+        began   = time.perf_counter_ns()
+        cat_cnt = len(self.categories)
+        scores  = np.zeros(len(vecs) * cat_cnt)
+
+        if ids:
+            rows    = np.concatenate(rows)
+            ids     = np.concatenate(ids)
+            weights = np.concatenate(weights)
+
+            # gather the postings of every (document, term) pair
+            start = self._post_ptr[ids]
+            count = self._post_ptr[ids + 1] - start
+            offs  = np.repeat(start - np.cumsum(count) + count, count)
+            offs += np.arange(offs.size)
+
+            scores = np.bincount(
+                np.repeat(rows, count) * cat_cnt + self._post_cat[offs],
+                weights=np.repeat(weights, count) * self._post_wgt[offs],
+                minlength=scores.size,
+            )
+
+        scores = scores.reshape(len(vecs), cat_cnt)
+        scores[nan_doc]           = math.nan
+        scores[:, self._nan_cats] = math.nan
+
+        # documents are scored together, so this is per chunk
+        if stats is not None:
+            stats.record('score', time.perf_counter_ns() - began)
+
+        return scores
+
+    def top_k(self, vec, k=1):
+        doc_ids, doc_wgt = self._weigh(vec)
+
+        # the same nan rules as argmax()
+        if doc_ids is None or self._nan_cats[0]:
+            return [(self.categories[0], math.nan)]
+
+        # max-score: walk the terms by decreasing upper bound, and once
+        # the remaining terms cannot lift an unseen category past the k-th
+        # best score, only look up the surviving candidates
+        bound = doc_wgt * self._post_max[doc_ids]
+        order = np.argsort(-bound, kind='stable')
+        rest  = float(bound.sum())
+        acc   = np.zeros(len(self.categories))
+        seen  = np.zeros(len(self.categories), dtype=bool)
+        theta = -math.inf
+        top   = np.zeros(0, dtype=np.int64)
+
+        # terms are taken in doubling blocks, so that the bound is only
+        # checked a logarithmic number of times
+        i     = 0
+        block = 1
+        while i < len(order):
+            terms  = order[i:i + block]
+            i     += len(terms)
+            block *= 2
+            rest   = float(bound[order[i:]].sum())
+
+            lo  = self._post_ptr[doc_ids[terms]]
+            cnt = self._post_ptr[doc_ids[terms] + 1] - lo
+            if not cnt.sum():
+                continue
+
+            # the postings of every term in the block, in term order
+            idx  = np.repeat(lo - np.cumsum(cnt) + cnt, cnt) + np.arange(cnt.sum())
+            cats = self._post_cat[idx]
+
+            np.add.at(acc, cats, np.repeat(doc_wgt[terms], cnt) * self._post_wgt[idx])
+            seen[cats] = True
+
+            # scores only grow, so the k-th best score is tracked from the
+            # previous k best and the categories this block just updated
+            if k == 1:
+                theta = max(theta, acc[cats].max())
+            else:
+                pool = np.union1d(top, cats)
+                top  = pool[np.argpartition(-acc[pool], k - 1)[:k]] if len(pool) > k else pool
+
+                if len(top) >= k:
+                    theta = acc[top].min()
+
+            if rest < theta:
+                break
+
+        if i < len(order):
+            cands = np.flatnonzero(seen & (acc + rest >= theta))
+
+            # postings are sorted by category, so the candidates can be
+            # looked up with a binary search instead of a full scan
+            for term in order[i:]:
+                lo = self._post_ptr[doc_ids[term]]
+                hi = self._post_ptr[doc_ids[term] + 1]
+
+                if lo == hi:
+                    continue
+
+                cats = self._post_cat[lo:hi]
+                pos  = np.minimum(np.searchsorted(cats, cands), hi - lo - 1)
+                hit  = cats[pos] == cands
+
+                acc[cands[hit]] += doc_wgt[term] * self._post_wgt[lo:hi][pos[hit]]
+        else:
+            cands = np.flatnonzero(seen)
+
+        # ties go to the lower category, as candidates are sorted
+        best = cands[np.argsort(-acc[cands], kind='stable')[:k]]
+        best = [(cat, float(acc[cat])) for cat in best.tolist()]
+
+        # categories without any shared term score zero and fill up the
+        # remaining slots in category order
+        for cat in range(len(self.categories)):
+            if len(best) >= k:
+                break
+
+            if not seen[cat] and not self._nan_cats[cat]:
+                best.append((cat, 0.0))
+
+        return [(self.categories[cat], score) for (cat, score) in best]
+
+    def _weigh(self, vec):
+        if self.vocab is None:
+            doc_ids = np.fromiter(vec.keys(), np.int64, len(vec))
+            doc_tfs = np.fromiter(vec.values(), np.float64, len(vec))
+        else:
+            doc_ids = [ ]
+            doc_tfs = [ ]
+            for word, tf in vec.items():
+                id = self.vocab.get(word)
+                if id is not None:
+                    doc_ids.append(id)
+                    doc_tfs.append(tf)
+
+            doc_ids = np.array(doc_ids, dtype=np.int64)
+            doc_tfs = np.array(doc_tfs, dtype=np.float64)
+
+        doc_wgt = doc_tfs * self.idf[doc_ids]
+        norm    = math.sqrt(doc_wgt @ doc_wgt)
+
+        if not norm:
+            return None, None
+
+        # the idf^2 of the dot product is part of the posting weights
+        return doc_ids, doc_tfs / norm
+
+
+class StemCache:
+    def __init__(self, size=65536):
+        self.size      = size
+        self.evictions = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._new      = { }
+        self._stems    = OrderedDict()
+
+    def __getstate__(self):
+        # only the warmed entries are worth persisting
+        return {'size': self.size, 'stems': self._stems}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'])
+        self._stems = state['stems']
+
+    def clear(self):
+        self.__init__(self.size)
+
+    def drain(self):
+        delta = (self.hits, self.misses, self.evictions, self._new)
+
+        self.evictions = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._new      = { }
+
+        return delta
+
+    def get(self, word, stem):
+        try:
+            self._stems.move_to_end(word)
+            self.hits += 1
+            return self._stems[word]
+        except KeyError:
+            pass
+
+        self.misses += 1
+
+        tmp = stem(word)
+        if self.size > 0:
+            self._new[word] = tmp
+            self.evictions += self._insert(word, tmp)
+
+        return tmp
+
+    def merge(self, delta):
+        hits, misses, evictions, new = delta
+
+        self.evictions += evictions
+        self.hits      += hits
+        self.misses    += misses
+
+        self.update(new)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate    = self.hits / lookups if lookups else 0.0
+
+        return (
+            f'Stem cache:  {len(self._stems)}/{self.size} entries, '
+            f'{self.hits} hits, {self.misses} misses, '
+            f'{self.evictions} evictions ({rate:.2%} hit rate)'
+        )
+
+    def stems(self):
+        return dict(self._stems)
+
+    def update(self, stems):
+        for word, stem in stems.items():
+            if word not in self._stems:
+                self._insert(word, stem)
+
+    def _insert(self, word, stem):
+        self._stems[word] = stem
+
+        if len(self._stems) > self.size:
+            self._stems.popitem(last=False)
+            return True
+
+        return False
+
 
 class Tester:
-    def __init__(self, db=None, verbose=False):
-        self.db      = db
-        self.predict = [ ]
-        self.verbose = verbose
+    def __init__(
+        self,
+        db=None,
+        dedup=False,
+        jobs=1,
+        max_score=False,
+        prediction_cache=None,
+        prefetcher=None,
+        token_cache=None,
+        trace=False,
+        verbose=False,
+    ):
+        self.db               = db
+        self.dedup            = dedup or prediction_cache is not None
+        self.jobs             = jobs
+        self.max_score        = max_score
+        self.predict          = [ ]
+        self.prediction_cache = prediction_cache
+        self.prefetcher       = prefetcher
+        self.token_cache      = token_cache
+        self.trace            = trace
+        self.verbose          = verbose
 
     def load(self, file):
         if self.verbose:
             print(f'Importing database from file: {file.name}')
 
-        self.db = pickle.load(file)
+        self.db = Database.load(file)
 
-    def test(self, file):
-        collection = self.db.collection
-        processor  = self.db.processor
+        if self.db.partial:
+            raise ValueError(f'partial databases must be merged first: {file.name}')
+
+        # signed weights break the upper bounds max-score relies on, and
+        # failing here leaves the output untouched
+        if self.max_score and self.db.processor.hasher is not None:
+            raise ValueError(f'max-score pruning is not supported by hashed databases: {file.name}')
+
+    def predictions(self, paths):
+        processor = self.db.processor
+        scorer    = Scorer.from_database(self.db)
 
         if self.verbose:
             print(
@@ -177,56 +1696,192 @@ class Tester:
                 f'Insensitive: {processor.insensitive}\n'
                 f'Stemming:    {processor.stemming}\n'
                 f'Stop Words:  {processor.stop_words}\n'
+                f'Tokenizer:   {processor.tokenizer}\n'
+                f'Hash Bits:   {processor.settings()["hash_bits"]}\n'
                 f'---'
             )
 
-        normalized = [ ]
-        for path in processor.gen_file_list(file):
-            if self.verbose:
-                print(f"Normalizing: '{path}'")
+        if self.dedup:
+            yield from self._dedup_predictions(paths, scorer)
+        else:
+            # read -> normalize -> vectorize lazily, then score and hand
+            # out one chunk at a time so that memory stays flat
+            paths, tmp = itertools.tee(paths)
+            cnts       = processor.count_files(
+                tmp,
+                self.jobs,
+                cache=self.token_cache,
+                prefetcher=self.prefetcher,
+            )
+            docs       = zip(paths, cnts)
+            while chunk := list(itertools.islice(docs, scorer.chunk_size)):
+                yield self._score(scorer, chunk)
 
-            f = open(path, 'r')
-            tokens = processor.normalize(f.read())
-            f.close()
+        if self.verbose:
+            if processor.stemming:
+                print(processor.stem_cache.stats())
 
-            normalized.append((path, tokens))
+            if self.token_cache is not None:
+                print(self.token_cache.stats())
 
-        uncat_vec = { }
-        for (path, tokens) in normalized:
-            if self.verbose:
-                print(f"Generating vector: '{path}'")
+            if self.prediction_cache is not None:
+                print(self.prediction_cache.stats())
+
+            print(processor.stats.summary())
+
+    def stream(self, file, output, resume=False):
+        processor = self.db.processor
 
-            uncat_vec[path] = processor.gen_vec(tokens)
+        done = set()
+        mode = 'w'
+        if resume and output != '-' and os.path.exists(output):
+            done = self._resume(output)
+            mode = 'a'
 
-        uncat_norm = { }
-        for path, vec in uncat_vec.items():
             if self.verbose:
-                print(f"Normalizing vector: '{path}'")
-
-            uncat_norm[path] = collection.norm(vec)
-
-        cat_norm   = self.db.cat_norm
-        cat_vec    = self.db.cat_vec
-        categories = list(self.db.cat_vec.keys())
-        predicted  = [ ]
-        for path in uncat_vec:
-            sim = { }
-            for cat in categories:
-                sim[cat] = collection.sim(
-                    collection.dot(cat_vec[cat], uncat_vec[path]),
-                    uncat_norm[path] * cat_norm[cat]
-                )
+                print(f'Resuming after {len(done)} documents: {output}')
 
-                if self.verbose:
-                    print(f"Similarity: '{path}' '{cat}' ==> {sim[cat]:.16f}")
+        # - writes the predictions to stdout, as argparse.FileType would
+        if output == '-':
+            out = contextlib.nullcontext(sys.stdout)
+        else:
+            out = open(output, mode)
+
+        paths = (path for path in processor.iter_file_list(file) if path not in done)
+        with out as out:
+            for predicted in self.predictions(paths):
+                processor.write_cat_file_tuples(predicted, out)
+                out.flush()
+
+    def test(self, file):
+        self.predict = [ ]
+        for predicted in self.predictions(self.db.processor.iter_file_list(file)):
+            self.predict += predicted
 
-            predicted.append((max(sim, key=sim.get), path))
+    def _resume(self, output):
+        with open(output, 'rb+') as f:
+            data = f.read()
 
-        self.predict = predicted
+            # drop a line cut short by a crash
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                f.truncate(end)
+
+        done = set()
+        for line in data[:end].decode().splitlines():
+            done.add(line.rsplit(maxsplit=1)[0])
+
+        return done
 
     def write(self, file):
         self.db.processor.write_cat_file_tuples(self.predict, file)
 
+    def _dedup_predictions(self, paths, scorer):
+        processor = self.db.processor
+        stats     = processor.stats
+
+        # every document is hashed once in this process, only the first
+        # copy of any contents is normalized and scored, and the others
+        # are resolved from its prediction when their chunk comes up
+        docs, tmp = itertools.tee(self._digests(paths))
+        cnts      = processor.count_strings(
+            (string for (_, _, _, string) in tmp if string is not None),
+            self.jobs,
+            cache=self.token_cache,
+        )
+        seen      = { }
+        while chunk := list(itertools.islice(docs, scorer.chunk_size)):
+            rows   = [(path, next(cnts)) for (path, _, _, string) in chunk if string is not None]
+            scored = iter(self._score(scorer, rows) if rows else [ ])
+
+            predicted = [ ]
+            for (path, key, cat, string) in chunk:
+                if string is not None:
+                    cat, _ = next(scored)
+
+                    if self.prediction_cache is not None:
+                        self.prediction_cache.put(key, cat)
+                elif cat is None:
+                    cat = seen[key]
+                    stats.count('duplicates')
+
+                    if self.trace:
+                        print(f"Duplicate: '{path}' ==> {cat}")
+
+                seen[key] = cat
+                predicted.append((cat, path))
+
+            yield predicted
+
+    def _digests(self, paths):
+        processor = self.db.processor
+        settings  = processor.norm_settings()
+        stats     = processor.stats
+
+        paths, tmp = itertools.tee(paths)
+        if self.prefetcher is not None:
+            strings = self.prefetcher.read(tmp, stats)
+        else:
+            strings = map(processor.read_file, tmp)
+
+        # (path, digest, cached category, contents to normalize)
+        keys = set()
+        for path, string in zip(paths, strings):
+            start = time.perf_counter_ns()
+            key   = tokcache.digest(settings, string)
+            cat   = None
+            if key not in keys and self.prediction_cache is not None:
+                cat = self.prediction_cache.get(key)
+                stats.count('prediction_cache_hits' if cat is not None else 'prediction_cache_misses')
+
+            stats.record('dedup', time.perf_counter_ns() - start)
+
+            if key in keys or cat is not None:
+                string = None
+
+            keys.add(key)
+
+            yield path, key, cat, string
+
+    def _score(self, scorer, chunk):
+        processor = self.db.processor
+        stats     = processor.stats
+
+        uncat_vec = [ ]
+        for (path, cnt) in chunk:
+            if self.trace:
+                print(f"Generating vector: '{path}'")
+
+            start = time.perf_counter_ns()
+            uncat_vec.append(processor.gen_tf(cnt))
+            stats.record('vectorize', time.perf_counter_ns() - start)
+
+        if self.max_score:
+            predicted = [ ]
+            for (path, _), vec in zip(chunk, uncat_vec):
+                start = time.perf_counter_ns()
+                [(cat, sim)] = scorer.top_k(vec)
+                stats.record('score', time.perf_counter_ns() - start)
+
+                if self.trace:
+                    print(f"Similarity: '{path}' '{cat}' ==> {sim:.16f}")
+
+                predicted.append((cat, path))
+
+            return predicted
+
+        scores    = scorer.score(uncat_vec, stats)
+        best      = scorer.argmax(scores)
+        predicted = [ ]
+        for row, (path, _) in enumerate(chunk):
+            if self.trace:
+                for cat, sim in zip(scorer.categories, scores[row]):
+                    print(f"Similarity: '{path}' '{cat}' ==> {sim:.16f}")
+
+            predicted.append((scorer.categories[best[row]], path))
+
+        return predicted
+
 
 class TestGenerator:
     def __init__(self):
@@ -254,27 +1909,118 @@ class TestGenerator:
 
 
 class Trainer:
-    def __init__(self, insensitive=True, stemming=True, stop_words=True, verbose=False):
-        self.db      = Database()
-        self.verbose = verbose
+    def __init__(
+        self,
+        insensitive=True,
+        stemming=True,
+        stop_words=True,
+        jobs=1,
+        prefetcher=None,
+        save_stem_cache=False,
+        stem_cache_size=65536,
+        tokenizer='nltk',
+        token_cache=None,
+        trace=False,
+        verbose=False,
+        hash_bits=0,
+        min_df=1,
+        max_df=1.0,
+        top_n=0,
+        partial=False,
+    ):
+        if min_df < 1 or not 0 < max_df <= 1 or top_n < 0:
+            raise ValueError(f'invalid pruning: min_df={min_df} max_df={max_df} top_n={top_n}')
+
+        # pruning needs the document frequencies of the whole corpus
+        if partial and (min_df > 1 or max_df < 1 or top_n):
+            raise ValueError('partial databases cannot be pruned')
+
+        self.db              = Database()
+        self.jobs            = jobs
+        self.max_df          = max_df
+        self.min_df          = min_df
+        self.partial         = partial
+        self.prefetcher      = prefetcher
+        self.save_stem_cache = save_stem_cache
+        self.token_cache     = token_cache
+        self.top_n           = top_n
+        self.trace           = trace
+        self.verbose         = verbose
 
         p = self.db.processor
+        p.hasher      = Hasher(hash_bits) if hash_bits else None
         p.insensitive = insensitive
+        p.stem_cache  = StemCache(stem_cache_size)
         p.stemming    = stemming
         p.stop_words  = stop_words
+        p.tokenizer   = tokenizer
+
+        if p.hasher is not None:
+            self.db.collection = HashedCollection(p.hasher.buckets)
 
     def dump(self, file):
         if self.verbose:
             print(f'Dumping database to file: {file.name}')
 
-        pickle.dump(self.db, file)
+        if not self.save_stem_cache:
+            self.db.processor.stem_cache.clear()
 
-    def train(self, labels):
+        self.db.dump(file, partial=self.partial)
+
+    def load(self, file):
+        if self.verbose:
+            print(f'Importing database from file: {file.name}')
+
+        self.db = Database.load(file)
+
+        if not getattr(self.db, 'cat_cnt', None):
+            raise ValueError(
+                f'database has no raw category counts: {file.name}'
+            )
+
+        if self.db.partial:
+            raise ValueError(f'partial databases must be merged first: {file.name}')
+
+        # the counts of pruned terms are gone for good
+        if self.db.pruning is not None:
+            raise ValueError(f'a pruned database cannot be updated: {file.name}')
+
+        self.save_stem_cache = bool(self.db.processor.stem_cache.stems())
+
+    def prune(self):
         collection = self.db.collection
-        processor  = self.db.processor
+        db         = self.db
+        start      = time.perf_counter_ns()
+
+        if db.processor.hasher is not None:
+            terms, weights = self._prune_hashed()
+        else:
+            terms, weights = self._prune()
+
+        # category vectors lost terms, so their norms changed
+        for cat, vec in db.cat_vec.items():
+            db.cat_norm[cat] = collection.norm(vec)
+
+        db.pruning = {
+            'max_df':         self.max_df,
+            'min_df':         self.min_df,
+            'terms_after':    terms[1],
+            'terms_before':   terms[0],
+            'top_n':          self.top_n,
+            'weights_after':  weights[1],
+            'weights_before': weights[0],
+        }
+
+        db.processor.stats.record('prune', time.perf_counter_ns() - start)
 
-        cat_tokens = { }
-        normalized = [ ]
+        if self.verbose:
+            print(
+                f'Pruned terms:   {terms[0]} -> {terms[1]}\n'
+                f'Pruned weights: {weights[0]} -> {weights[1]}'
+            )
+
+    def train(self, labels):
+        processor = self.db.processor
 
         if self.verbose:
             print(
@@ -282,44 +2028,220 @@ class Trainer:
                 f'Insensitive: {processor.insensitive}\n'
                 f'Stemming:    {processor.stemming}\n'
                 f'Stop Words:  {processor.stop_words}\n'
+                f'Tokenizer:   {processor.tokenizer}\n'
+                f'Hash Bits:   {processor.settings()["hash_bits"]}\n'
                 f'---'
             )
 
-        for (cat, path) in processor.gen_cat_file_tuples(labels):
-            if self.verbose:
-                print(f"Normalizing: '{path}' '{cat}'")
+        self._add(labels)
+
+        # idfs, vectors and norms are left to Merger
+        if self.partial:
+            self.db.partial = True
+        else:
+            self._finalize(self.db.cat_cnt)
+
+        if self.min_df > 1 or self.max_df < 1 or self.top_n:
+            self.prune()
+
+        if self.verbose:
+            print(processor.stats.summary())
 
-            f = open(path, 'r')
-            tokens = processor.normalize(f.read())
-            f.close()
+    def update(self, labels):
+        processor = self.db.processor
+
+        if self.verbose:
+            print(
+                f'Updating with...\n'
+                f'Insensitive: {processor.insensitive}\n'
+                f'Stemming:    {processor.stemming}\n'
+                f'Stop Words:  {processor.stop_words}\n'
+                f'Tokenizer:   {processor.tokenizer}\n'
+                f'Hash Bits:   {processor.settings()["hash_bits"]}\n'
+                f'---'
+            )
+
+        self._finalize(self._add(labels))
+
+        if self.verbose:
+            print(processor.stats.summary())
+
+    def _add(self, labels):
+        processor = self.db.processor
+
+        # labels are read lazily and every document is folded into the
+        # counts right away, so memory is bounded by the vocabulary
+        tuples, tmp = itertools.tee(processor.iter_cat_file_tuples(labels))
+        paths       = (path for (_, path) in tmp)
+        docs        = processor.count_files(
+            paths,
+            self.jobs,
+            cache=self.token_cache,
+            prefetcher=self.prefetcher,
+        )
+        touched     = self._add_counts(zip(tuples, docs))
+
+        if self.verbose:
+            if processor.stemming:
+                print(processor.stem_cache.stats())
+
+            if self.token_cache is not None:
+                print(self.token_cache.stats())
+
+        return touched
+
+    def _add_counts(self, docs):
+        collection = self.db.collection
+        processor  = self.db.processor
+
+        cat_cnt = self.db.cat_cnt
+        hasher  = processor.hasher
+        stats   = processor.stats
+        touched = { }
+
+        for (cat, path), doc_cnt in docs:
+            if self.trace:
+                print(f"Adding to collection: '{path}' '{cat}'")
+
+            start = time.perf_counter_ns()
+
+            # hashed counts are keyed by bucket rather than by term
+            if hasher is not None:
+                ids, sums = hasher.bucket(doc_cnt)
+                collection.add_doc(ids)
+                doc_cnt = dict(zip(ids.tolist(), sums.tolist()))
+            else:
+                collection.add_doc(doc_cnt)
 
             try:
-                cat_tokens[cat] += tokens
+                cnt = cat_cnt[cat]
             except KeyError:
-                cat_tokens[cat]  = [ ]
-                cat_tokens[cat] += tokens
+                cnt = cat_cnt[cat] = { }
 
-            normalized.append((cat, path, tokens))
+            for word, frq in doc_cnt.items():
+                try:
+                    cnt[word] += frq
+                except KeyError:
+                    cnt[word] = frq
 
-        for (cat, path, tokens) in normalized:
-            if self.verbose:
-                print(f"Adding to collection: '{path}' '{cat}'")
+            touched[cat] = True
 
-            collection.add_doc(tokens)
+            stats.record('vectorize', time.perf_counter_ns() - start)
 
-        if self.verbose:
-            print(f"Calculating collection idfs")
+        return touched
+
+    def _prune(self):
+        collection = self.db.collection
+        db         = self.db
+
+        doc_frq = collection._doc_frq
+        idf     = collection._idf
+        limit   = self.max_df * collection._doc_cnt
+
+        terms   = [len(doc_frq)]
+        weights = [sum(len(vec) for vec in db.cat_vec.values())]
+
+        kept = { }
+        for word, frq in doc_frq.items():
+            if self.min_df <= frq <= limit:
+                kept[word] = True
+
+        # a term survives if it is among the heaviest of any category,
+        # terms no category keeps never contribute to a dot product
+        used = { }
+        for cat, vec in db.cat_vec.items():
+            words = [word for word in vec if word in kept]
+
+            if self.top_n:
+                words = heapq.nlargest(self.top_n, words, key=lambda word: vec[word] * idf[word])
+
+            keep = dict.fromkeys(words, True)
+
+            db.cat_vec[cat] = {word: tf for word, tf in vec.items() if word in keep}
+            db.cat_cnt[cat] = {word: frq for word, frq in db.cat_cnt[cat].items() if word in keep}
+
+            used.update(keep)
+
+        collection._doc_frq = {word: frq for word, frq in doc_frq.items() if word in used}
+        collection._idf     = {word: idf[word] for word in collection._doc_frq}
+
+        terms.append(len(collection._doc_frq))
+        weights.append(sum(len(vec) for vec in db.cat_vec.values()))
+
+        return terms, weights
+
+    def _prune_hashed(self):
+        collection = self.db.collection
+        db         = self.db
+
+        doc_frq = collection._doc_frq
+        idf     = collection._idf
+        limit   = self.max_df * collection._doc_cnt
+
+        terms   = [int(np.count_nonzero(doc_frq))]
+        weights = [sum(len(vec) for vec in db.cat_vec.values())]
 
+        kept = (doc_frq >= self.min_df) & (doc_frq <= limit)
+        used = np.zeros(len(doc_frq), dtype=bool)
+        for cat, vec in db.cat_vec.items():
+            ids = np.array(sorted(vec), dtype=np.int64)
+            ids = ids[kept[ids]]
+
+            # weights can be negative, so the heaviest are by magnitude
+            if self.top_n:
+                wgt = np.abs(np.array([vec[bucket] for bucket in ids.tolist()]) * idf[ids])
+                ids = ids[np.argsort(-wgt, kind='stable')[:self.top_n]]
+
+            cnt = db.cat_cnt[cat]
+
+            db.cat_vec[cat] = {bucket: vec[bucket] for bucket in ids.tolist()}
+            db.cat_cnt[cat] = {bucket: cnt[bucket] for bucket in ids.tolist()}
+
+            used[ids] = True
+
+        # unused buckets drop out of the idf, like unknown terms
+        doc_frq[~used] = 0
         collection.cache()
 
-        for cat, tokens in cat_tokens.items():
-            if self.verbose:
+        terms.append(int(np.count_nonzero(doc_frq)))
+        weights.append(sum(len(vec) for vec in db.cat_vec.values()))
+
+        return terms, weights
+
+    def _finalize(self, cats):
+        collection = self.db.collection
+        processor  = self.db.processor
+        stats      = processor.stats
+
+        for cat in cats:
+            if self.trace:
                 print(f"Generating vector: '{cat}'")
 
-            self.db.cat_vec[cat] = processor.gen_vec(tokens)
+            start = time.perf_counter_ns()
+
+            if processor.hasher is not None:
+                self.db.cat_vec[cat] = processor.hasher.gen_tf(self.db.cat_cnt[cat])
+            else:
+                self.db.cat_vec[cat] = processor.gen_tf(self.db.cat_cnt[cat])
+
+            stats.record('vectorize', time.perf_counter_ns() - start)
+
+        # a new document changes the document count and with it every
+        # idf, so all norms are stale once the collection is uncached
+        if collection._cached:
+            return
+
+        if self.verbose:
+            print(f"Calculating collection idfs")
+
+        start = time.perf_counter_ns()
+        collection.cache()
+        stats.record('idf', time.perf_counter_ns() - start)
 
         for cat, vec in self.db.cat_vec.items():
-            if self.verbose:
+            if self.trace:
                 print(f"Normalizing vector: '{cat}'")
 
+            start = time.perf_counter_ns()
             self.db.cat_norm[cat] = collection.norm(vec)
+            stats.record('norm', time.perf_counter_ns() - start)
@@ -0,0 +1,197 @@
+# tcdb.py -- text categorization database format
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import mmap
+import struct
+import zlib
+
+import numpy as np
+
+
+# A database is a header, a table of named sections, and the sections
+# themselves.  Every section is a flat array aligned to eight bytes so
+# it can be used straight out of the mapped file.  Small, unstructured
+# values (settings, category names, ...) live in the json 'meta' section.
+#
+#   header:  magic, version, section count, reserved
+#   entry:   name, numpy dtype, offset, item count
+
+MAGIC   = b'TCDB'
+VERSION = 1
+
+_ALIGN  = 8
+_ENTRY  = struct.Struct('<16s8sQQ')
+_HEADER = struct.Struct('<4sIII')
+
+
+class File:
+    def __init__(self, file):
+        self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, cnt, _ = _HEADER.unpack_from(self._mmap, 0)
+
+        if magic != MAGIC:
+            raise ValueError(f'not a tcdb database: {file.name}')
+
+        if version != VERSION:
+            raise ValueError(f'unsupported tcdb version: {version}')
+
+        self.arrays = { }
+        for i in range(cnt):
+            name, dtype, offset, count = _ENTRY.unpack_from(
+                self._mmap,
+                _HEADER.size + i * _ENTRY.size,
+            )
+
+            self.arrays[name.rstrip(b'\0').decode()] = np.frombuffer(
+                self._mmap,
+                dtype=np.dtype(dtype.rstrip(b'\0').decode()),
+                count=count,
+                offset=offset,
+            )
+
+        self.meta = json.loads(self.arrays.pop('meta').tobytes())
+
+    def vocabulary(self):
+        return Vocabulary(
+            self.arrays['vocab_blob'],
+            self.arrays['vocab_offs'],
+            self.arrays['vocab_hash'],
+        )
+
+
+class Vocabulary:
+    def __init__(self, blob, offs, table):
+        self._blob  = blob
+        self._mask  = len(table) - 1
+        self._offs  = offs
+        self._table = table
+
+        # found terms, so a term costs a dict lookup after its first
+        # probe while memory stays bounded by the vocabulary
+        self._ids   = { }
+
+        # python copies of the arrays, made on the first probe since
+        # plain python objects are much cheaper to index than numpy
+        # scalars and opening the database should stay free
+        self._probe = None
+
+    def __iter__(self):
+        offs = self._offs.tolist()
+        blob = self._blob.tobytes()
+
+        for i in range(len(offs) - 1):
+            yield blob[offs[i]:offs[i + 1]].decode()
+
+    def __len__(self):
+        return len(self._offs) - 1
+
+    def get(self, term, default=None):
+        try:
+            return self._ids[term]
+        except KeyError:
+            pass
+
+        if self._probe is None:
+            self._probe = (self._blob.tobytes(), self._offs.tolist(), self._table.tolist())
+
+        blob, offs, table = self._probe
+
+        key  = term.encode()
+        slot = _hash(key) & self._mask
+
+        while True:
+            id = table[slot]
+
+            if id < 0:
+                return default
+
+            if blob[offs[id]:offs[id + 1]] == key:
+                self._ids[term] = id
+
+                return id
+
+            slot = (slot + 1) & self._mask
+
+
+def build_vocabulary(terms):
+    keys = [term.encode() for term in terms]
+
+    offs = np.zeros(len(keys) + 1, dtype='<u8')
+    np.cumsum([len(key) for key in keys], out=offs[1:])
+
+    # open addressing with linear probing at a load factor <= 0.5
+    size = 1
+    while size < 2 * len(keys):
+        size <<= 1
+
+    mask  = size - 1
+    table = np.full(size, -1, dtype='<i4')
+    for id, key in enumerate(keys):
+        slot = _hash(key) & mask
+
+        while table[slot] >= 0:
+            slot = (slot + 1) & mask
+
+        table[slot] = id
+
+    return {
+        'vocab_blob': np.frombuffer(b''.join(keys), dtype='u1'),
+        'vocab_hash': table,
+        'vocab_offs': offs,
+    }
+
+
+def is_tcdb(file):
+    magic = file.read(len(MAGIC))
+    file.seek(0)
+
+    return magic == MAGIC
+
+
+def write(file, meta, arrays):
+    arrays = {'meta': np.frombuffer(json.dumps(meta).encode(), dtype='u1'), **arrays}
+
+    offset  = _HEADER.size + len(arrays) * _ENTRY.size
+    entries = [ ]
+    for name, array in arrays.items():
+        offset = -(-offset // _ALIGN) * _ALIGN
+
+        entries.append(_ENTRY.pack(
+            name.encode(),
+            array.dtype.str.encode(),
+            offset,
+            array.size,
+        ))
+
+        offset += array.nbytes
+
+    file.write(_HEADER.pack(MAGIC, VERSION, len(arrays), 0))
+    file.write(b''.join(entries))
+
+    offset = _HEADER.size + len(arrays) * _ENTRY.size
+    for array in arrays.values():
+        pad = -offset % _ALIGN
+        file.write(b'\0' * pad)
+        file.write(np.ascontiguousarray(array).tobytes())
+
+        offset += pad + array.nbytes
+
+
+def _hash(key):
+    # stable across processes, unlike hash()
+    return zlib.crc32(key)
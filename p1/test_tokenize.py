@@ -0,0 +1,80 @@
+# test_tokenize.py -- fast tokenizer conformance tests
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import difflib
+
+import pytest
+
+import tc
+
+
+pytest.importorskip('nltk')
+
+# minimum share of word_tokenize() tokens fast_tokenize() must reproduce
+AGREEMENT = 0.95
+
+SAMPLE = [
+    "I don't think it's going to work, isn't it?",
+    'She said "hello there" and left.',
+    'Wait... what -- really?',
+    'The price rose 3.5% to $1,200.50 on 12/03/2021.',
+    "We'll see; they've gone, you're late and I'm tired.",
+    "He can't, won't and shouldn't -- 'quoted' text.",
+    'Numbers like 1,000,000 and 3.14159 and -42 appear.',
+    "e-mail me at home... or don't.",
+    'Mr. Smith went to the U.S. in Jan. and paid $5.',
+    '(see p. 5) [a] {b} <c>',
+    "rock 'n' roll isn't 'cause",
+    "ALL CAPS DON'T MATTER",
+]
+
+# cases the regular expression is meant to match exactly
+EXACT = [
+    ("don't", ['do', "n't"]),
+    ("can't", ['ca', "n't"]),
+    ("it's", ['it', "'s"]),
+    ("we'll they've you're I'm he'd", ['we', "'ll", 'they', "'ve", 'you', "'re", 'I', "'m", 'he', "'d"]),
+    ('"quoted"', ['``', 'quoted', "''"]),
+    ('wait...', ['wait', '...']),
+    ('this -- that', ['this', '--', 'that']),
+    ('well-known', ['well-known']),
+    ('1,000,000 3.14159 -42', ['1,000,000', '3.14159', '-42']),
+    ('$1,200.50 3.5%', ['$', '1,200.50', '3.5', '%']),
+    ('end.', ['end', '.']),
+]
+
+
+def test_fast_tokenize_agreement():
+    word_tokenize = tc.nltk_word_tokenize()
+
+    matched   = 0
+    reference = 0
+    for text in SAMPLE:
+        ref = word_tokenize(text)
+        can = tc.fast_tokenize(text)
+
+        blocks = difflib.SequenceMatcher(None, ref, can, autojunk=False).get_matching_blocks()
+
+        matched   += sum(block.size for block in blocks)
+        reference += len(ref)
+
+    assert matched / reference >= AGREEMENT
+
+
+@pytest.mark.parametrize('text, tokens', EXACT)
+def test_fast_tokenize_exact(text, tokens):
+    assert tc.fast_tokenize(text) == tokens
+    assert tc.nltk_word_tokenize()(text) == tokens
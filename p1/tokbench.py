@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# tokbench.py -- tokenizer conformance and throughput
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import difflib
+import json
+import time
+
+from nltk.tokenize import word_tokenize
+
+import tc
+
+
+TOKENIZERS = {
+    'fast': tc.fast_tokenize,
+    'nltk': word_tokenize,
+}
+
+
+def bench(texts, tokenize, rounds):
+    tokens = 0
+    start  = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            tokens += len(tokenize(text))
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        'seconds':        elapsed,
+        'tokens':         tokens,
+        'tokens_per_sec': tokens / elapsed if elapsed else 0.0,
+    }
+
+
+def conformance(texts, limit):
+    matched   = 0
+    reference = 0
+    candidate = 0
+    documents = 0
+    mismatch  = { }
+    for text in texts:
+        ref = word_tokenize(text)
+        can = tc.fast_tokenize(text)
+
+        blocks = difflib.SequenceMatcher(None, ref, can, autojunk=False).get_matching_blocks()
+        match  = sum(block.size for block in blocks)
+
+        matched   += match
+        reference += len(ref)
+        candidate += len(can)
+        documents += match == len(ref) == len(can)
+
+        # remember the most common disagreements
+        a = b = 0
+        for block in blocks:
+            key = (' '.join(ref[a:block.a]), ' '.join(can[b:block.b]))
+            if key != ('', ''):
+                mismatch[key] = mismatch.get(key, 0) + 1
+
+            a = block.a + block.size
+            b = block.b + block.size
+
+    worst = sorted(mismatch.items(), key=lambda item: -item[1])[:limit]
+
+    return {
+        'documents_identical': documents / len(texts) if texts else 0.0,
+        'f1':                  2 * matched / (reference + candidate) if matched else 0.0,
+        'mismatches': [
+            {'count': cnt, 'fast': can, 'nltk': ref} for ((ref, can), cnt) in worst
+        ],
+        'precision':           matched / candidate if candidate else 0.0,
+        'recall':              matched / reference if reference else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tokenizer conformance and throughput')
+
+    parser.add_argument(
+        '-i',
+        help='input documents (list or labels)',
+        metavar='input',
+        required=True,
+        type=argparse.FileType('r'),
+    )
+    parser.add_argument(
+        '-m',
+        '--mismatches',
+        default=10,
+        help='number of common disagreements to report',
+        metavar='count',
+        type=int,
+    )
+    parser.add_argument(
+        '-r',
+        '--rounds',
+        default=1,
+        help='number of passes over the documents when timing',
+        metavar='rounds',
+        type=int,
+    )
+
+    args = parser.parse_args()
+
+    texts = [ ]
+    for line in args.i:
+        if not line.strip():
+            continue
+
+        with open(line.split()[0], 'r') as f:
+            texts.append(f.read())
+
+    report = {
+        'conformance': conformance(texts, args.mismatches),
+        'throughput': {
+            name: bench(texts, tokenize, args.rounds)
+            for name, tokenize in TOKENIZERS.items()
+        },
+    }
+
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
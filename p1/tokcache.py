@@ -0,0 +1,228 @@
+# tokcache.py -- persistent normalized token cache
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import sqlite3
+import struct
+import time
+
+import numpy as np
+
+
+# The cache maps a digest of a document's contents, salted with the
+# normalization settings, to the token counts of the normalized
+# document.  Entries are encoded as:
+#
+#   header: <BI (count width in bytes, number of terms)
+#   counts: unsigned integers of the given width
+#   terms:  utf-8, NUL separated, in first occurrence order
+
+# bump whenever normalization changes its output
+VERSION = 1
+
+HEADER = struct.Struct('<BI')
+WIDTHS = (
+    (np.uint8,  0xff),
+    (np.uint16, 0xffff),
+    (np.uint32, 0xffffffff),
+)
+
+# pending entries written per transaction
+FLUSH = 512
+
+# evict down to this fraction of the maximum size
+LOW_WATER = 0.9
+
+
+def decode(blob):
+    width, n = HEADER.unpack_from(blob)
+    if not n:
+        return { }
+
+    start  = HEADER.size
+    counts = np.frombuffer(blob, WIDTHS[width >> 1][0], n, start).tolist()
+    terms  = blob[start + n * width:].decode('utf-8').split('\0')
+
+    return dict(zip(terms, counts))
+
+
+def encode(cnt):
+    terms = '\0'.join(cnt)
+
+    # a NUL inside a term would corrupt the encoding
+    if terms.count('\0') != max(len(cnt) - 1, 0):
+        return None
+
+    counts = list(cnt.values())
+    top    = max(counts, default=0)
+    for width, (dtype, limit) in zip((1, 2, 4), WIDTHS):
+        if top <= limit:
+            break
+    else:
+        return None
+
+    return (
+        HEADER.pack(width, len(counts))
+        + np.array(counts, dtype).tobytes()
+        + terms.encode('utf-8')
+    )
+
+
+def digest(settings, string):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((VERSION, settings)).encode())
+    h.update(b'\0')
+    h.update(string.encode('utf-8', 'surrogatepass'))
+
+    return h.digest()
+
+
+class TokenCache:
+    def __init__(self, path, max_bytes=1 << 30, writer=True):
+        self.evictions = 0
+        self.max_bytes = max_bytes
+        self.path      = path
+        self.writer    = writer
+
+        self._pending = { }
+        self._touched = { }
+
+        self._conn = sqlite3.connect(path, timeout=60)
+
+        if writer:
+            # readers in worker processes are not blocked by the writer
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tokens ('
+                'key BLOB PRIMARY KEY, data BLOB NOT NULL, atime INTEGER NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS tokens_atime ON tokens (atime)')
+            self._conn.commit()
+
+            self.size = self._conn.execute(
+                'SELECT COALESCE(SUM(LENGTH(key) + LENGTH(data)), 0) FROM tokens'
+            ).fetchone()[0]
+
+    def close(self):
+        if self.writer:
+            self.flush()
+
+        self._conn.close()
+
+    def drain(self):
+        delta = (self._pending, list(self._touched))
+
+        self._pending = { }
+        self._touched = { }
+
+        return delta
+
+    def flush(self):
+        if not (self._pending or self._touched):
+            return
+
+        now = int(time.time())
+
+        with self._conn:
+            # several workers may have normalized the same contents
+            for key, data in self._pending.items():
+                cur = self._conn.execute(
+                    'INSERT OR IGNORE INTO tokens VALUES (?, ?, ?)',
+                    (key, data, now),
+                )
+                if cur.rowcount:
+                    self.size += len(key) + len(data)
+
+            self._conn.executemany(
+                'UPDATE tokens SET atime = ? WHERE key = ?',
+                ((now, key) for key in self._touched),
+            )
+
+        self._pending = { }
+        self._touched = { }
+
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def get(self, key):
+        try:
+            return decode(self._pending[key])
+        except KeyError:
+            pass
+
+        row = self._conn.execute('SELECT data FROM tokens WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        self._touched[key] = True
+        self._autoflush()
+
+        return decode(row[0])
+
+    def merge(self, delta):
+        pending, touched = delta
+
+        self._pending.update(pending)
+        self._touched.update(dict.fromkeys(touched, True))
+        self._autoflush()
+
+    def put(self, key, cnt):
+        data = encode(cnt)
+        if data is None:
+            return
+
+        self._pending[key] = data
+        self._autoflush()
+
+    def stats(self):
+        if self.writer:
+            self.flush()
+
+        entries = self._conn.execute('SELECT COUNT(*) FROM tokens').fetchone()[0]
+
+        return (
+            f'Token cache: {entries} entries, '
+            f'{self.size / (1 << 20):.1f}/{self.max_bytes / (1 << 20):.1f} MiB, '
+            f'{self.evictions} evictions'
+        )
+
+    def _autoflush(self):
+        if self.writer and len(self._pending) + len(self._touched) >= FLUSH:
+            self.flush()
+
+    def _evict(self):
+        target = int(self.max_bytes * LOW_WATER)
+
+        # least recently used first
+        evict = [ ]
+        rows  = self._conn.execute(
+            'SELECT key, LENGTH(key) + LENGTH(data) FROM tokens ORDER BY atime'
+        )
+        for key, size in rows:
+            if self.size <= target:
+                break
+
+            evict.append((key,))
+            self.size -= size
+
+        rows.close()
+
+        with self._conn:
+            self._conn.executemany('DELETE FROM tokens WHERE key = ?', evict)
+
+        self.evictions += len(evict)
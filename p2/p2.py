@@ -17,6 +17,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import sys
 
 import parser
 
@@ -29,20 +30,110 @@ def main():
         help='context free grammar in chomsky normal form',
         metavar='grammar.cnf',
     )
+    argparser.add_argument(
+        '-b',
+        '--batch',
+        help='parse every line of a file, - for stdin, as json lines',
+        metavar='sentences',
+        type=argparse.FileType('r'),
+    )
+    argparser.add_argument(
+        '-j',
+        '--jobs',
+        default=1,
+        help='number of batch parsing processes',
+        metavar='jobs',
+        type=int,
+    )
+    argparser.add_argument(
+        '-k',
+        '--best',
+        default=0,
+        help='only find the k most likely parses of a probabilistic grammar',
+        metavar='k',
+        type=int,
+    )
+    argparser.add_argument(
+        '-m',
+        '--max-parses',
+        help='maximum number of parses printed per sentence',
+        metavar='parses',
+        type=int,
+    )
     argparser.add_argument(
         '-p',
         '--parse-tree',
         action='store_true',
         help='enable textual parse trees',
     )
+    argparser.add_argument(
+        '-r',
+        '--recognize-only',
+        action='store_true',
+        help='only report whether sentences are valid',
+    )
+    argparser.add_argument(
+        '-t',
+        '--timing',
+        action='store_true',
+        help='report the time spent on every batch sentence',
+    )
+    argparser.add_argument(
+        '--beam',
+        default=0,
+        help='keep at most this many non-terminals per chart cell with -k, 0 disables',
+        metavar='size',
+        type=int,
+    )
+    argparser.add_argument(
+        '--threshold',
+        default=0.0,
+        help='prune non-terminals less likely than this ratio of the best in a cell with -k',
+        metavar='ratio',
+        type=float,
+    )
 
     args = argparser.parse_args()
 
+    if args.max_parses is not None and args.max_parses < 0:
+        argparser.error(f'argument -m/--max-parses: must not be negative: {args.max_parses}')
+
+    if args.best < 0:
+        argparser.error(f'argument -k/--best: must not be negative: {args.best}')
+
+    if args.beam < 0:
+        argparser.error(f'argument --beam: must not be negative: {args.beam}')
+
+    if not 0 <= args.threshold <= 1:
+        argparser.error(f'argument --threshold: must be between 0 and 1: {args.threshold}')
+
     cli = parser.Cli()
 
     cli.parse_grammar(args.grammar)
 
-    cli.cli(args.parse_tree)
+    if args.batch is None:
+        cli.cli(
+            args.parse_tree,
+            args.max_parses,
+            args.recognize_only,
+            args.best,
+            args.beam,
+            args.threshold,
+        )
+        return
+
+    cli.batch(
+        args.batch,
+        sys.stdout,
+        beam=args.beam,
+        best=args.best,
+        jobs=args.jobs,
+        max_parses=args.max_parses,
+        parse_tree=args.parse_tree,
+        recognize_only=args.recognize_only,
+        threshold=args.threshold,
+        timing=args.timing,
+    )
 
 
 if __name__ == '__main__':
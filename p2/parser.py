@@ -14,8 +14,75 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import heapq
+import itertools
+import json
+import math
+import multiprocessing
+import time
+
+from collections import deque
 from dataclasses import dataclass, field
 
+import numpy as np
+
+
+# per worker cli and options, see Cli.batch()
+_cli      = None
+_settings = None
+
+
+def _batch_init(cli, settings):
+    global _cli, _settings
+    _cli      = cli
+    _settings = settings
+
+
+def _batch_lines(lines):
+    return [_cli.batch_line(line, **_settings) for line in lines]
+
+
+@dataclass
+class CompiledGrammar:
+    names:   list[str]                         = field(default_factory=list, kw_only=True)
+    ids:     dict[str, int]                    = field(default_factory=dict, kw_only=True)
+    binary:  dict[(int, int), tuple[int, ...]] = field(default_factory=dict, kw_only=True)
+    lexicon: dict[str, tuple[int, ...]]        = field(default_factory=dict, kw_only=True)
+    start:   int                               = field(default=-1,           kw_only=True)
+
+    # log probabilities, in the order of the heads they belong to
+    binary_logp:  dict[(int, int), tuple[float, ...]] = field(default_factory=dict, kw_only=True)
+    lexicon_logp: dict[str, tuple[float, ...]]        = field(default_factory=dict, kw_only=True)
+
+    # binary rules by left child, then right child, to (heads, logp)
+    by_left:      dict[int, dict[int, tuple]]         = field(default_factory=dict, kw_only=True)
+
+    # built on the first recognize()
+    _tensor: tuple[np.ndarray, ...]            = field(default=None, compare=False, init=False, repr=False)
+
+    def intern(self, name: str) -> int:
+        try:
+            return self.ids[name]
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+
+            return self.ids[name]
+
+    def rule_tensor(self) -> tuple[np.ndarray, ...]:
+        if self._tensor is not None:
+            return self._tensor
+
+        # the boolean rule tensor [A, B, C] in coordinate form, one
+        # (B, C, A) triple per binary rule, so memory grows with the
+        # size of the grammar rather than the cube of its nonterminals
+        rules = [(b, c, a) for (b, c), nterms in self.binary.items() for a in nterms]
+        rules = np.array(rules, dtype=np.int32).reshape(-1, 3)
+
+        self._tensor = (rules[:, 0], rules[:, 1], rules[:, 2])
+
+        return self._tensor
+
 
 @dataclass
 class Grammar:
@@ -23,7 +90,13 @@ class Grammar:
     terminals:  dict[str, list[str]]        = field(default_factory=dict, kw_only=True)
     start_symb: str                         = field(default='S',          kw_only=True)
 
-    def add_rule(self, rule: str, nterma: str, ntermb: str):
+    # rule probabilities keyed by (A, B, C) or (A, w), 1 if omitted
+    probs:      dict[tuple, float]          = field(default_factory=dict, kw_only=True)
+
+    # rebuilt on the first parse after the grammar changes
+    _compiled:  CompiledGrammar             = field(default=None, compare=False, init=False, repr=False)
+
+    def add_rule(self, rule: str, nterma: str, ntermb: str, prob: float = None):
         nterm = (nterma, ntermb)
 
         try:
@@ -31,28 +104,91 @@ class Grammar:
         except KeyError:
             self.rules[rule] = [nterm]
 
-    def add_terminal(self, rule: str, term: str):
+        if prob is not None:
+            self.add_prob((rule, nterma, ntermb), prob)
+
+        self._compiled = None
+
+    def add_prob(self, rule: tuple, prob: float):
+        if not 0 < prob <= 1:
+            raise ValueError(f"invalid probability for rule '{' '.join(rule)}': {prob}")
+
+        self.probs[rule] = prob
+
+    def add_terminal(self, rule: str, term: str, prob: float = None):
         try:
             self.terminals[rule].append(term)
         except KeyError:
             self.terminals[rule] = [term]
 
-    def parse(self, input: list[str]) -> list[tuple]:
-        if not input:
-            return [ ]
+        if prob is not None:
+            self.add_prob((rule, term), prob)
+
+        self._compiled = None
+
+    def compile(self) -> CompiledGrammar:
+        # the start symbol can change without touching any rule, so it
+        # is resolved again on every parse rather than rebuilding
+        if self._compiled is not None:
+            self._compiled.start = self._compiled.ids.get(self.start_symb, -1)
+
+            return self._compiled
 
-        matrix = [[ [] for i in range(len(input) + 1) ] for j in range(len(input) + 1)]
+        compiled = CompiledGrammar()
+
+        # reverse indexes from right hand sides to the nonterminals
+        # deriving them, each listed once and in grammar order, along
+        # with the log probability of the most likely such rule
+        binary  = { }
+        lexicon = { }
+
+        for rule, nterms in self.rules.items():
+            a = compiled.intern(rule)
+            for nterma, ntermb in nterms:
+                heads = binary.setdefault((compiled.intern(nterma), compiled.intern(ntermb)), { })
+                logp  = math.log(self.probs.get((rule, nterma, ntermb), 1.0))
+                heads[a] = max(heads.get(a, logp), logp)
+
+        for rule, terms in self.terminals.items():
+            a = compiled.intern(rule)
+            for term in terms:
+                heads = lexicon.setdefault(term, { })
+                logp  = math.log(self.probs.get((rule, term), 1.0))
+                heads[a] = max(heads.get(a, logp), logp)
+
+        compiled.binary       = {rhs: tuple(heads) for rhs, heads in binary.items()}
+        compiled.binary_logp  = {rhs: tuple(heads.values()) for rhs, heads in binary.items()}
+        compiled.lexicon      = {term: tuple(heads) for term, heads in lexicon.items()}
+        compiled.lexicon_logp = {term: tuple(heads.values()) for term, heads in lexicon.items()}
+        compiled.start        = compiled.ids.get(self.start_symb, -1)
+
+        for (b, c), heads in compiled.binary.items():
+            compiled.by_left.setdefault(b, { })[c] = (heads, compiled.binary_logp[b, c])
+
+        self._compiled = compiled
+
+        return compiled
+
+    def parse(self, input: list[str]) -> 'Forest':
+        compiled = self.compile()
+        binary   = compiled.binary
+
+        # a packed forest: one entry per nonterminal and span, holding
+        # either its word or every (split, left, right) deriving it
+        matrix = [[ {} for i in range(len(input) + 1) ] for j in range(len(input) + 1)]
+        forest = Forest(input=input, chart=matrix, names=compiled.names, start=compiled.start)
 
         for j in range(1, len(input) + 1):
-            for rule, terminals in self.terminals.items():
-                if input[j - 1] in terminals:
-                    matrix[j - 1][j].append((rule, input[j - 1]))
+            for a in compiled.lexicon.get(input[j - 1], ()):
+                matrix[j - 1][j][a] = [input[j - 1]]
 
             # lexicon is not in our grammar
             if not matrix[j - 1][j]:
-                return [ ]
+                return forest
 
             for i in reversed(range(j - 1)):
+                cell = matrix[i][j]
+
                 for k in range(i + 1, j):
                     rules_l = matrix[i][k]
                     rules_r = matrix[k][j]
@@ -61,22 +197,257 @@ class Grammar:
                     if not rules_l or not rules_r:
                         continue
 
-                    for rule_tup_l in rules_l:
-                        for rule_tup_r in rules_r:
+                    for b in rules_l:
+                        for c in rules_r:
                             # possible rule from cells i,k and k,j
-                            rule = (rule_tup_l[0], rule_tup_r[0])
+                            try:
+                                heads = binary[b, c]
+                            except KeyError:
+                                continue
+
+                            back = (k, b, c)
+                            for a in heads:
+                                try:
+                                    cell[a].append(back)
+                                except KeyError:
+                                    cell[a] = [back]
 
-                            for name, rules in self.rules.items():
-                                if rule in rules:
-                                    matrix[i][j].append((name, (rule_tup_l, rule_tup_r)))
+        return forest
 
-        # collect valid parses
-        parses = [ ]
-        for parse in matrix[0][len(input)]:
-            if self.start_symb == parse[0]:
-                parses.append(parse)
+    def recognize(self, input: list[str]) -> bool:
+        compiled = self.compile()
 
-        return parses
+        if not input or compiled.start < 0:
+            return False
+
+        left, right, heads = compiled.rule_tensor()
+
+        # cells are boolean vectors over the nonterminals
+        matrix = np.zeros((len(input) + 1, len(input) + 1, len(compiled.names)), dtype=bool)
+
+        for j in range(1, len(input) + 1):
+            nterms = compiled.lexicon.get(input[j - 1])
+
+            # lexicon is not in our grammar
+            if not nterms:
+                return False
+
+            matrix[j - 1, j, nterms] = True
+
+            for i in reversed(range(j - 1)):
+                # every split at once: gathering the stacked left and
+                # right cells at the rule coordinates gives, per split
+                # and rule, whether cells i,k and k,j hold its (B, C)
+                hit = (matrix[i, i + 1:j][:, left] & matrix[i + 1:j, j][:, right]).any(axis=0)
+
+                matrix[i, j, heads[hit]] = True
+
+        return bool(matrix[0, len(input), compiled.start])
+
+    def viterbi(
+        self,
+        input: list[str],
+        best: int = 1,
+        beam: int = 0,
+        threshold: float = 0.0,
+    ) -> list[tuple[float, tuple]]:
+        if best < 1:
+            raise ValueError(f'invalid number of best parses: {best}')
+
+        if beam < 0:
+            raise ValueError(f'invalid beam size: {beam}')
+
+        if not 0 <= threshold <= 1:
+            raise ValueError(f'invalid threshold: {threshold}')
+
+        compiled = self.compile()
+        by_left  = compiled.by_left
+        floor    = math.log(threshold) if threshold > 0 else -math.inf
+
+        # cells map nonterminals to their best (log probability,
+        # backpointer) entries, most likely first, where a backpointer
+        # is a word or (split, left, left rank, right, right rank)
+        matrix = [[ {} for i in range(len(input) + 1) ] for j in range(len(input) + 1)]
+
+        for j in range(1, len(input) + 1):
+            word = input[j - 1]
+            cell = matrix[j - 1][j]
+
+            for a, logp in zip(compiled.lexicon.get(word, ()), compiled.lexicon_logp.get(word, ())):
+                cell[a] = [(logp, word)]
+
+            self._prune(cell, beam, floor)
+
+            # lexicon is not in our grammar
+            if not cell:
+                return [ ]
+
+            for i in reversed(range(j - 1)):
+                # min-heaps of at most best entries per nonterminal
+                heaps = { }
+
+                for k in range(i + 1, j):
+                    rules_l = matrix[i][k]
+                    rules_r = matrix[k][j]
+
+                    # skip empty cells
+                    if not rules_l or not rules_r:
+                        continue
+
+                    for b, ents_l in rules_l.items():
+                        try:
+                            rights = by_left[b]
+                        except KeyError:
+                            continue
+
+                        # walk the smaller of the rules with this left
+                        # child and the right cell, so that a split
+                        # costs at most one visit per rule
+                        if len(rights) < len(rules_r):
+                            pairs = ((c, rules_r[c], rule) for c, rule in rights.items() if c in rules_r)
+                        else:
+                            pairs = ((c, ents_r, rights[c]) for c, ents_r in rules_r.items() if c in rights)
+
+                        for c, ents_r, (heads, logps) in pairs:
+                            # plain viterbi, only the best entries combine
+                            if best == 1:
+                                logp_lr = ents_l[0][0] + ents_r[0][0]
+
+                                for a, logp in zip(heads, logps):
+                                    logp += logp_lr
+
+                                    try:
+                                        if logp <= heaps[a][0][0]:
+                                            continue
+                                    except KeyError:
+                                        pass
+
+                                    heaps[a] = [(logp, (k, b, 0, c, 0))]
+
+                                continue
+
+                            for a, logp in zip(heads, logps):
+                                heap = heaps.setdefault(a, [ ])
+
+                                for rank_l, (logp_l, _) in enumerate(ents_l):
+                                    for rank_r, (logp_r, _) in enumerate(ents_r):
+                                        ent = (logp + logp_l + logp_r, (k, b, rank_l, c, rank_r))
+
+                                        if len(heap) < best:
+                                            heapq.heappush(heap, ent)
+                                        elif ent > heap[0]:
+                                            heapq.heapreplace(heap, ent)
+
+                cell = matrix[i][j]
+                for a, heap in heaps.items():
+                    cell[a] = sorted(heap, reverse=True)
+
+                self._prune(cell, beam, floor)
+
+        top = matrix[0][len(input)].get(compiled.start, [ ]) if input else [ ]
+
+        return [
+            (logp, self._viterbi_tree(matrix, compiled.start, 0, len(input), rank))
+            for rank, (logp, _) in enumerate(top)
+        ]
+
+    def _prune(self, cell: dict, beam: int, floor: float):
+        if not cell:
+            return
+
+        # drop nonterminals far less likely than the best in the cell,
+        # then keep at most beam of the most likely ones
+        top = max(ents[0][0] for ents in cell.values())
+        for a in [a for a, ents in cell.items() if ents[0][0] < top + floor]:
+            del cell[a]
+
+        if beam and len(cell) > beam:
+            keep = set(heapq.nlargest(beam, cell, key=lambda a: cell[a][0][0]))
+            for a in [a for a in cell if a not in keep]:
+                del cell[a]
+
+    def _viterbi_tree(self, matrix: list, a: int, i: int, j: int, rank: int) -> tuple:
+        name    = self.compile().names[a]
+        _, back = matrix[i][j][a][rank]
+
+        if type(back) is str:
+            return (name, back)
+
+        k, b, rank_l, c, rank_r = back
+
+        return (
+            name,
+            (
+                self._viterbi_tree(matrix, b, i, k, rank_l),
+                self._viterbi_tree(matrix, c, k, j, rank_r),
+            ),
+        )
+
+
+@dataclass
+class Forest:
+    input: list[str]                   = field(default_factory=list, kw_only=True)
+    chart: list[list[dict[int, list]]] = field(default_factory=list, kw_only=True)
+    names: list[str]                   = field(default_factory=list, kw_only=True)
+    start: int                         = field(default=-1,           kw_only=True)
+
+    # parse counts per cell, filled in on the first count()
+    _counts: list[list[dict[int, int]]] = field(default=None, compare=False, init=False, repr=False)
+
+    def __bool__(self) -> bool:
+        return self.count() > 0
+
+    def __iter__(self):
+        return self.trees()
+
+    def count(self) -> int:
+        if not self.input or self.start not in self.chart[0][len(self.input)]:
+            return 0
+
+        if self._counts is None:
+            self._counts = self._count_cells()
+
+        return self._counts[0][len(self.input)][self.start]
+
+    def trees(self):
+        if self:
+            yield from self._trees(self.start, 0, len(self.input))
+
+    def _count_cells(self) -> list[list[dict[int, int]]]:
+        n      = len(self.input)
+        counts = [[ {} for i in range(n + 1) ] for j in range(n + 1)]
+
+        # shorter spans first, so both halves of a split are counted
+        for length in range(1, n + 1):
+            for i in range(n - length + 1):
+                j = i + length
+
+                for a, backs in self.chart[i][j].items():
+                    total = 0
+                    for back in backs:
+                        if type(back) is str:
+                            total += 1
+                            continue
+
+                        k, b, c = back
+                        total += counts[i][k][b] * counts[k][j][c]
+
+                    counts[i][j][a] = total
+
+        return counts
+
+    def _trees(self, a: int, i: int, j: int):
+        name = self.names[a]
+
+        for back in self.chart[i][j][a]:
+            if type(back) is str:
+                yield (name, back)
+                continue
+
+            k, b, c = back
+            for left in self._trees(b, i, k):
+                for right in self._trees(c, k, j):
+                    yield (name, (left, right))
 
 
 @dataclass
@@ -85,7 +456,15 @@ class Cli:
     indent_str: str     = field(default='    ',          kw_only=True)
     prompt:     str     = field(default='(p2)',          kw_only=True)
 
-    def cli(self, parse_tree=False):
+    def cli(
+        self,
+        parse_tree=False,
+        max_parses=None,
+        recognize_only=False,
+        best=0,
+        beam=0,
+        threshold=0.0,
+    ):
         parse_str = self.parse_tree_str if parse_tree else self.parse_str
 
         print(
@@ -117,20 +496,41 @@ class Cli:
                         print()  # newline
                         continue
 
+                    if recognize_only:
+                        valid = self.grammar.recognize(sentence.split())
+                        print('VALID SENTENCE' if valid else 'NO VLAID PARSES')
+                        continue
+
+                    if best:
+                        parses = self.grammar.viterbi(sentence.split(), best, beam, threshold)
+
+                        if not parses:
+                            print('NO VLAID PARSES')
+                            continue
+
+                        print('VALID SENTENCE')
+                        for parse_cnt, (logp, parse) in enumerate(parses, 1):
+                            print(f'parse: {parse_cnt} (log probability: {logp:.6f})')
+                            print(parse_str(parse))
+
+                        continue
+
                     parses = self.grammar.parse(sentence.split())
 
                     if not parses:
                         print('NO VLAID PARSES')
                         continue
 
+                    # trees are built one at a time, and only as many
+                    # as are printed
                     parse_cnt = 0
                     print('VALID SENTENCE')
-                    for parse in parses:
+                    for parse in itertools.islice(parses, max_parses):
                         parse_cnt += 1
                         print(f'parse: {parse_cnt}')
                         print(parse_str(parse))
 
-                    print(f'number of valid parses: {len(parses)}')
+                    print(f'number of valid parses: {parses.count()}')
 
                 case 'quit' | 'q':
                     break
@@ -140,14 +540,86 @@ class Cli:
 
         print('goodbye!')
 
+    def batch(self, file, out, jobs=1, chunksize=16, **settings):
+        # compiled once here, so that workers inherit it
+        self.grammar.compile()
+
+        if jobs <= 1:
+            for line in file:
+                out.write(self.batch_line(line, **settings) + '\n')
+
+            return
+
+        with multiprocessing.Pool(jobs, _batch_init, (self, settings)) as pool:
+            # Pool.imap() drains its input eagerly, so a bounded number
+            # of chunks is kept in flight instead, topped up as soon as
+            # the oldest is written, so that a slow sentence only holds
+            # back the output and never leaves the other workers idle
+            lines   = iter(file)
+            pending = deque()
+            while True:
+                while len(pending) < jobs * 4 and (chunk := list(itertools.islice(lines, chunksize))):
+                    pending.append(pool.apply_async(_batch_lines, (chunk,)))
+
+                if not pending:
+                    break
+
+                for result in pending.popleft().get():
+                    out.write(result + '\n')
+
+    def batch_line(
+        self,
+        line: str,
+        max_parses=None,
+        parse_tree=False,
+        recognize_only=False,
+        timing=False,
+        best=0,
+        beam=0,
+        threshold=0.0,
+    ) -> str:
+        parse_str = self.parse_tree_str if parse_tree else self.parse_str
+        sentence  = line.split()
+        result    = {'sentence': ' '.join(sentence)}
+
+        start = time.perf_counter()
+
+        if recognize_only:
+            result['valid'] = self.grammar.recognize(sentence)
+        elif best:
+            parses = self.grammar.viterbi(sentence, best, beam, threshold)
+
+            result['log_probs'] = [logp for (logp, _) in parses]
+            result['trees']     = [parse_str(parse) for (_, parse) in parses]
+            result['valid']     = bool(parses)
+        else:
+            parses = self.grammar.parse(sentence)
+
+            result['parses'] = parses.count()
+            result['trees']  = [parse_str(parse) for parse in itertools.islice(parses, max_parses)]
+            result['valid']  = result['parses'] > 0
+
+        if timing:
+            result['seconds'] = time.perf_counter() - start
+
+        return json.dumps(result)
+
     def parse_grammar(self, file_path: str):
         with open(file_path) as grammar:
             for line in grammar.readlines():
                 tokens = line.split()
 
+                # an optional last column holds the rule probability
                 match len(tokens):
+                    case 5:
+                        self.grammar.add_rule(tokens[0], tokens[2], tokens[3], float(tokens[4]))
                     case 4:
-                        self.grammar.add_rule(tokens[0], tokens[2], tokens[3])
+                        try:
+                            prob = float(tokens[3])
+                        except ValueError:
+                            self.grammar.add_rule(tokens[0], tokens[2], tokens[3])
+                        else:
+                            self.grammar.add_terminal(tokens[0], tokens[2], prob)
                     case 3:
                         self.grammar.add_terminal(tokens[0], tokens[2])
                     case _:
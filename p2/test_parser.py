@@ -0,0 +1,175 @@
+# test_parser.py -- parser tests
+# Copyright (C) 2022  Jacob Koziej <jacobkoziej@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import os
+
+import pytest
+
+import parser
+
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_grammar.cnf')
+
+SENTENCES = [
+    'book the flight through houston',
+    'i prefer a flight on nwa',
+    'book the flight through houston near houston on nwa',
+    'does the flight include a meal',
+    'she prefers books',
+    'i prefer the cheap flight from houston to houston on nwa through houston near houston',
+    'the flight',
+    'book the flight to houston on nwa from houston through houston near houston to houston',
+    'fly',
+    'flight the book',
+    'book book',
+    '',
+]
+
+
+def sample_grammar():
+    cli = parser.Cli()
+    cli.parse_grammar(SAMPLE)
+
+    return cli.grammar
+
+
+def ambiguous_grammar():
+    # S --> S S | a, every bracketing of a^n is a parse
+    grammar = parser.Grammar()
+    grammar.add_rule('S', 'S', 'S')
+    grammar.add_terminal('S', 'a')
+
+    return grammar
+
+
+def probabilistic_grammar():
+    # an ambiguous PCFG whose parses of a^n differ in probability
+    grammar = parser.Grammar()
+    grammar.add_rule('S', 'S', 'S', 0.3)
+    grammar.add_rule('S', 'A', 'S', 0.2)
+    grammar.add_terminal('S', 'a', 0.5)
+    grammar.add_rule('A', 'A', 'A', 0.4)
+    grammar.add_terminal('A', 'a', 0.6)
+
+    return grammar
+
+
+def logp(grammar, tree):
+    name, children = tree
+
+    if type(children) is str:
+        return math.log(grammar.probs[name, children])
+
+    left, right = children
+
+    return math.log(grammar.probs[name, left[0], right[0]]) + logp(grammar, left) + logp(grammar, right)
+
+
+@pytest.mark.parametrize('sentence', SENTENCES)
+def test_recognize_sample_grammar(sentence):
+    grammar = sample_grammar()
+    words   = sentence.split()
+
+    assert grammar.recognize(words) == bool(grammar.parse(words))
+
+
+@pytest.mark.parametrize('words', [['a'] * n for n in range(1, 9)] + [['a', 'b'], ['b', 'a', 'a']])
+def test_recognize_ambiguous_grammar(words):
+    grammar = ambiguous_grammar()
+
+    assert grammar.recognize(words) == bool(grammar.parse(words))
+
+
+def test_recognize_sample_grammar_results():
+    grammar = sample_grammar()
+
+    assert grammar.recognize('book the flight through houston'.split())
+    assert not grammar.recognize('flight the book'.split())
+    assert not grammar.recognize([ ])
+
+
+def test_start_symbol_change():
+    grammar = sample_grammar()
+    words   = 'the flight'.split()
+
+    assert not grammar.parse(words)
+    assert not grammar.recognize(words)
+
+    grammar.start_symb = 'NP'
+
+    assert grammar.parse(words).count() == 1
+    assert grammar.recognize(words)
+    assert len(grammar.viterbi(words)) == 1
+
+
+@pytest.mark.parametrize('n', range(1, 16))
+def test_count_ambiguous_grammar(n):
+    forest = ambiguous_grammar().parse(['a'] * n)
+
+    # a^n has one parse per binary bracketing, Catalan(n - 1) of them
+    assert forest.count() == math.comb(2 * (n - 1), n - 1) // n
+
+
+@pytest.mark.parametrize('n', range(1, 8))
+def test_trees_ambiguous_grammar(n):
+    forest = ambiguous_grammar().parse(['a'] * n)
+    trees  = list(forest)
+
+    assert len(trees) == forest.count()
+    assert len(set(trees)) == len(trees)
+
+
+def test_count_unparsable():
+    forest = ambiguous_grammar().parse(['a', 'b'])
+
+    assert forest.count() == 0
+    assert list(forest) == [ ]
+
+
+@pytest.mark.parametrize('n', range(1, 8))
+@pytest.mark.parametrize('best', [1, 3, 10])
+def test_viterbi_matches_brute_force(n, best):
+    grammar = probabilistic_grammar()
+    words   = ['a'] * n
+
+    # score every tree of the forest and keep the most likely ones
+    scores = sorted((logp(grammar, tree) for tree in grammar.parse(words)), reverse=True)[:best]
+    parses = grammar.viterbi(words, best)
+
+    assert [logp_ for (logp_, _) in parses] == pytest.approx(scores)
+
+    for logp_, tree in parses:
+        assert logp(grammar, tree) == pytest.approx(logp_)
+
+
+def test_viterbi_unparsable():
+    grammar = probabilistic_grammar()
+
+    assert grammar.viterbi(['a', 'b'], 2) == [ ]
+    assert grammar.viterbi([ ], 2) == [ ]
+
+
+@pytest.mark.parametrize('settings', [
+    {'best': 0},
+    {'best': -1},
+    {'beam': -1},
+    {'threshold': -0.1},
+    {'threshold': 1.5},
+])
+def test_viterbi_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        probabilistic_grammar().viterbi(['a', 'a'], **settings)